@@ -0,0 +1,205 @@
+import random
+import numpy as np
+from simulation import WIDTH, HEIGHT, PADDLE_OFFSET, TRAINING_RULES
+
+PADDLE_LENGTH = 100
+PADDLE_WIDTH = 20
+PADDLE_VEL = 7
+BALL_RADIUS = 15
+BALL_MAX_VEL = 7
+
+# Top left corners, same as the rects of the Paddle and Ball classes in simulation.py
+PADDLE1_X = PADDLE_OFFSET - PADDLE_WIDTH // 2
+PADDLE2_X = WIDTH - PADDLE_OFFSET - PADDLE_WIDTH // 2
+PADDLE_START_Y = HEIGHT // 2 - PADDLE_LENGTH // 2
+BALL_START_X = WIDTH // 2 - BALL_RADIUS // 2
+BALL_START_Y = HEIGHT // 2 - BALL_RADIUS // 2
+
+# Decisions, same meaning as the output index of the networks
+UP = 0
+DOWN = 1
+STAY = 2
+
+
+def round_coordinates(values):
+    # Same rounding as simulation.round_coordinate, half away from zero like pygame.Rect
+    whole = np.trunc(values)
+    return (whole + np.where(np.abs(values - whole) >= 0.5, np.sign(values), 0)).astype(np.int64)
+
+
+def initialize_y_vel(rng):
+    # Same draws as Ball.initialize_y_vel so seeded matches get the same serves
+    y_vel = rng.randint(-3, 3)
+    while y_vel == 0:
+        y_vel = rng.randint(-3, 3)
+
+    return y_vel
+
+
+def blocked(paddle_y, actions):
+    # Paddles that tried to move past the top or bottom of the screen
+    return (((actions == UP) & (paddle_y <= 0)) |
+            ((actions == DOWN) & (paddle_y + PADDLE_LENGTH >= HEIGHT)))
+
+
+def predict_intercepts(ball_x, ball_y, x_vel, y_vel, rules=TRAINING_RULES):
+    # The center y of the balls, given by the top left corners of their rects, on the tick they reach the paddle they're
+    # moving towards, exactly as Ball.move and handle_collisions move them under the rules as long as no paddle is hit
+    # Ticks until the ball reaches the paddle, the same checks as the hits in handle_collisions
+    hit_x = ball_x + BALL_RADIUS // 2 if rules.right_hit_from_center else ball_x
+    distance = np.where(x_vel > 0, PADDLE2_X - BALL_RADIUS - hit_x, ball_x - PADDLE1_X - PADDLE_WIDTH)
+    ticks = np.maximum(-(-distance // np.abs(x_vel)), 0)
+
+    # Ball.move rounds y + y_vel half away from zero, so while y + y_vel isn't negative a ball moves by its speed
+    # rounded every tick. A speed ending in .5 goes down a pixel further than it goes up
+    speed = np.abs(y_vel).astype(np.float64)
+    down = round_coordinates(speed)
+    up = np.where(speed - np.trunc(speed) == 0.5, down - 1, down)
+    lookahead = speed if rules.wall_lookahead else 0
+    # handle_collisions turns the ball around once its y is at or past these, going down and going up
+    bottom_falling = np.ceil(HEIGHT - BALL_RADIUS - lookahead).astype(np.int64)
+    bottom_rising = np.ceil(HEIGHT - BALL_RADIUS + lookahead).astype(np.int64)
+    safe_down = np.maximum(down, 1)
+    safe_up = np.maximum(up, 1)
+    y = np.array(ball_y, dtype=np.int64)
+    falling = np.array(y_vel > 0)
+    # Balls slower than half a pixel a tick never move
+    left = np.where(down > 0, ticks, 0)
+
+    # Jumps from bounce to bounce. Next to the walls, where the rounding or the bounces don't follow the pattern, the
+    # balls are moved a tick at a time like Ball.move and handle_collisions do
+    while (left > 0).any():
+        # Going down from y >= 0 the ball moves by down, until it reaches the bottom
+        regular_fall = falling & (y >= 0)
+        fall_ticks = np.maximum(-(-(bottom_falling - y) // safe_down), 1)
+        # Going up while y - speed isn't negative it moves by up, until it reaches the top
+        regular_rise = ~falling & (y >= speed) & (y - up < bottom_rising)
+        rise_steps = np.where(regular_rise, np.floor((y - speed) / safe_up).astype(np.int64) + 1, 0)
+        rise_ticks = -(-y // safe_up)
+        rise_flips = (up > 0) & (rise_ticks <= rise_steps)
+        # A speed of .5 doesn't go up at all
+        rise_ticks = np.where(rise_flips, rise_ticks, np.where(up > 0, rise_steps, left))
+
+        regular = regular_fall | regular_rise
+        to_flip = np.where(regular_fall, fall_ticks, rise_ticks)
+        flips = np.where(regular_fall, True, rise_flips) & (to_flip <= left)
+        jump = np.where(regular, np.minimum(to_flip, left), 1)
+        jumped_y = np.where(falling, y + jump * down, y - jump * up)
+
+        # A single tick, exactly as the simulation does it
+        vel = np.where(falling, speed, -speed)
+        ticked_y = round_coordinates(y + vel)
+        tick_flips = (ticked_y <= 0) | (ticked_y + BALL_RADIUS + (vel if rules.wall_lookahead else 0) >= HEIGHT)
+
+        moving = left > 0
+        y = np.where(moving, np.where(regular, jumped_y, ticked_y), y)
+        falling = falling ^ (moving & np.where(regular, flips, tick_flips))
+        left = np.where(moving, left - jump, 0)
+
+    return y + BALL_RADIUS // 2
+
+
+class BatchPong:
+    # Steps n training matches at once, the state of every match is a slot in the arrays below
+    # Applies TRAINING_RULES like Ball.move and handle_collisions in simulation.py, finished matches are left untouched
+    # A match is over once someone scores, the left paddle has max_hits hits or it has lasted max_ticks ticks
+    def __init__(self, n, seeds=None, max_hits=50, max_ticks=None):
+        self.n = n
+        self.max_hits = max_hits
+        self.max_ticks = max_ticks
+        # How far each paddle moves in a tick, the computer of game.py moves its paddle at AI_LEVEL instead
+        self.paddle1_vel = PADDLE_VEL
+        self.paddle2_vel = PADDLE_VEL
+
+        self.ball_x = np.empty(n, dtype=np.int64)
+        self.ball_y = np.empty(n, dtype=np.int64)
+        self.ball_x_vel = np.empty(n, dtype=np.int64)
+        self.ball_y_vel = np.empty(n, dtype=np.float64)
+        self.paddle1_y = np.empty(n, dtype=np.int64)
+        self.paddle2_y = np.empty(n, dtype=np.int64)
+        self.hits1 = np.empty(n, dtype=np.int64)
+        self.hits2 = np.empty(n, dtype=np.int64)
+        self.score1 = np.empty(n, dtype=np.int64)
+        self.score2 = np.empty(n, dtype=np.int64)
+        self.ticks = np.empty(n, dtype=np.int64)
+        self.active = np.empty(n, dtype=bool)
+
+        self.rngs = [None] * n
+        self.reset(seeds)
+
+    def reset(self, seeds=None, indices=None):
+        # Starts new matches in the given slots, all of them by default
+        if indices is None:
+            indices = np.arange(self.n)
+        if seeds is None:
+            seeds = [None] * len(indices)
+        for i, seed in zip(indices, seeds):
+            self.rngs[i] = random.Random(seed)
+
+        self.ball_x[indices] = BALL_START_X
+        self.ball_y[indices] = BALL_START_Y
+        self.ball_x_vel[indices] = BALL_MAX_VEL
+        self.ball_y_vel[indices] = [initialize_y_vel(self.rngs[i]) for i in indices]
+        self.paddle1_y[indices] = PADDLE_START_Y
+        self.paddle2_y[indices] = PADDLE_START_Y
+        self.hits1[indices] = 0
+        self.hits2[indices] = 0
+        self.score1[indices] = 0
+        self.score2[indices] = 0
+        self.ticks[indices] = 0
+        self.active[indices] = True
+
+    def move_paddles(self, paddle_y, actions, vel):
+        up = self.active & (actions == UP) & (paddle_y > 0)
+        down = self.active & (actions == DOWN) & (paddle_y + PADDLE_LENGTH < HEIGHT)
+        paddle_y += vel * (down.view(np.int8) - up.view(np.int8))
+
+    def step(self, actions1, actions2):
+        # Returns the matches that finished on this tick
+        active = self.active
+        self.move_paddles(self.paddle1_y, actions1, self.paddle1_vel)
+        self.move_paddles(self.paddle2_y, actions2, self.paddle2_vel)
+
+        # Move the ball
+        self.ball_x = np.where(active, self.ball_x + self.ball_x_vel, self.ball_x)
+        self.ball_y = np.where(active, round_coordinates(self.ball_y + self.ball_y_vel), self.ball_y)
+
+        # Check for collisions with wall
+        wall = active & ((self.ball_y <= 0) | (self.ball_y + BALL_RADIUS >= HEIGHT))
+        self.ball_y_vel[wall] = -self.ball_y_vel[wall]
+
+        # Check for collisions on left and right sides
+        scored2 = active & (self.ball_x + BALL_RADIUS <= 0)
+        scored1 = active & ~scored2 & (self.ball_x >= WIDTH)
+        self.score2 += scored2
+        self.score1 += scored1
+        for i in np.flatnonzero(scored1 | scored2):
+            self.ball_x[i] = BALL_START_X
+            self.ball_y[i] = BALL_START_Y
+            self.ball_y_vel[i] = initialize_y_vel(self.rngs[i])
+        self.ball_x_vel[scored2] = BALL_MAX_VEL
+        self.ball_x_vel[scored1] = -BALL_MAX_VEL
+
+        # Paddle deflections, the ball bounces off at an angle depending on where it hit the paddle
+        ball_centery = self.ball_y + BALL_RADIUS // 2
+        moving_left = self.ball_x_vel < 0
+        hit1 = (active & moving_left &
+                (self.paddle1_y <= ball_centery) & (ball_centery <= self.paddle1_y + PADDLE_LENGTH) &
+                (PADDLE1_X + PADDLE_WIDTH >= self.ball_x))
+        hit2 = (active & ~moving_left &
+                (self.paddle2_y <= ball_centery) & (ball_centery <= self.paddle2_y + PADDLE_LENGTH) &
+                (PADDLE2_X <= self.ball_x + BALL_RADIUS))
+        hit = hit1 | hit2
+        paddle_centery = np.where(hit1, self.paddle1_y, self.paddle2_y) + PADDLE_LENGTH // 2
+        y_vel = ((paddle_centery - ball_centery) / (PADDLE_LENGTH / 2)) * BALL_MAX_VEL
+        self.ball_x_vel[hit] = -self.ball_x_vel[hit]
+        self.ball_y_vel[hit] = -y_vel[hit]
+        self.hits1 += hit1
+        self.hits2 += hit2
+
+        self.ticks += active
+        finished = active & ((self.score1 > 0) | (self.score2 > 0) | (self.hits1 >= self.max_hits))
+        if self.max_ticks is not None:
+            finished |= active & (self.ticks >= self.max_ticks)
+        self.active = active & ~finished
+        return finished
@@ -0,0 +1,238 @@
+import argparse
+import json
+import platform
+import random
+import time
+
+import neat
+import numpy as np
+
+import training
+from batch_pong import BatchPong
+from compiled_net import CompiledNetwork, NetworkBatch
+from pong_env import PongEnv
+
+# Every benchmark runs for at least this long, so the rates aren't dominated by timer noise
+MIN_TIME = 1.0
+POPULATION_SIZES = [10, 25, 50]
+
+
+def measure(step, min_time=MIN_TIME):
+    # Calls step until min_time has passed, step returns how many units of work it did
+    units = 0
+    start = time.perf_counter()
+    while True:
+        units += step()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return units / elapsed
+
+
+def load_config(config_file='config.txt'):
+    return neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                       neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                       config_file)
+
+
+def make_genomes(config, n, seed=0):
+    # A reproducible population, mutated a few times so the networks have some hidden nodes
+    random.seed(seed)
+    config.pop_size = n
+    population = neat.Population(config)
+    for genome in population.population.values():
+        for _ in range(5):
+            genome.mutate(config.genome_config)
+
+    return list(population.population.items())
+
+
+def bench_simulation():
+    # Ticks of the Ball / Paddle / handle_collisions loop from training.py with the paddles following the ball
+    def step():
+        paddle1 = training.Paddle(training.PADDLE_OFFSET, training.HEIGHT // 2)
+        paddle2 = training.Paddle(training.WIDTH - training.PADDLE_OFFSET, training.HEIGHT // 2)
+        ball = training.Ball(training.WIDTH // 2, training.HEIGHT // 2, random.Random(0))
+        for _ in range(1000):
+            for paddle in (paddle1, paddle2):
+                if ball.rect.centery < paddle.rect.centery and paddle.rect.top > 0:
+                    paddle.move('up')
+                elif ball.rect.centery > paddle.rect.centery and paddle.rect.bottom < training.HEIGHT:
+                    paddle.move('down')
+            ball.move()
+            training.handle_collisions(ball, paddle1, paddle2)
+        return 1000
+
+    return measure(step)
+
+
+def bench_batch_simulation(n=256):
+    env = BatchPong(n, seeds=range(n), max_hits=10 ** 9)
+    actions = np.full(n, 2)
+
+    def step():
+        for _ in range(100):
+            env.step(actions, actions)
+            env.reset(None, np.flatnonzero(~env.active))
+        return 100 * n
+
+    return measure(step)
+
+
+def bench_env(n=256):
+    # bench_batch_simulation with the observations of the networks, through PongEnv
+    env = PongEnv(n, seeds=range(n), max_hits=10 ** 9)
+    actions = np.full((2, n), 2)
+
+    def step():
+        for _ in range(100):
+            env.step(actions)
+            env.reset(None, np.flatnonzero(~env.pong.active))
+        return 100 * n
+
+    return measure(step)
+
+
+def bench_activations(config, genomes, slots=256):
+    inputs = [(random.randint(0, 400), random.randint(0, 500), random.randint(0, 800)) for _ in range(1000)]
+    neat_nets = [neat.nn.FeedForwardNetwork.create(genome, config) for _, genome in genomes]
+    compiled = [CompiledNetwork.create(genome, config) for _, genome in genomes]
+
+    def run(nets):
+        def step():
+            for net, x in zip(nets * (len(inputs) // len(nets) + 1), inputs):
+                net.activate(x)
+            return len(inputs)
+        return step
+
+    batch = NetworkBatch.for_networks(slots, compiled)
+    for slot in range(slots):
+        batch.set(slot, compiled[slot % len(compiled)])
+    batch_inputs = np.array(inputs[:slots])
+
+    def batch_step():
+        for _ in range(100):
+            batch.activate(batch_inputs)
+        return 100 * slots
+
+    return {
+        'neat_activations_per_sec': measure(run(neat_nets)),
+        'compiled_activations_per_sec': measure(run(compiled)),
+        'batch_activations_per_sec': measure(batch_step),
+    }
+
+
+def bench_matches(config, genomes):
+    pairings = [(i, (i + 1) % len(genomes)) for i in range(len(genomes))]
+
+    def step():
+        for i, j in pairings:
+            genome1, genome2 = genomes[i][1], genomes[j][1]
+            genome1.fitness = genome2.fitness = 0
+            training.train_ai(genome1, genome2, config, 0, seed=training.match_seed(genome1, genome2))
+        return len(pairings)
+
+    return measure(step)
+
+
+def bench_generations(config, sizes):
+    # Every size evaluates a fresh population with the match cache and the hall of fame of training cleared, so no
+    # size is served results of matches another one played
+    cache, hall_of_fame = training.CACHE, list(training.hall_of_fame)
+    training.CACHE = False
+    results = {}
+    try:
+        for n in sizes:
+            genomes = make_genomes(config, n)
+            training.hall_of_fame.clear()
+            start = time.perf_counter()
+            training.eval_genomes(genomes, config)
+            results[str(n)] = time.perf_counter() - start
+    finally:
+        training.CACHE = cache
+        training.hall_of_fame[:] = hall_of_fame
+
+    return results
+
+
+def run_benchmarks(sizes=POPULATION_SIZES, workers=1):
+    config = load_config()
+    genomes = make_genomes(config, 20)
+    training.WORKERS = workers
+    try:
+        results = {
+            'ticks_per_sec': bench_simulation(),
+            'batch_ticks_per_sec': bench_batch_simulation(),
+            'env_ticks_per_sec': bench_env(),
+            **bench_activations(config, genomes),
+            'matches_per_sec': bench_matches(config, genomes),
+            'generation_seconds': bench_generations(config, sizes),
+        }
+    finally:
+        training.close_pool()
+
+    return {
+        'machine': platform.platform(),
+        'python': platform.python_version(),
+        'workers': workers,
+        'schedule': training.SCHEDULE,
+        'results': results,
+    }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, current, threshold):
+    # Returns the metrics that got slower than the baseline by more than threshold (0.1 is 10%)
+    # Rates should go up and the generation times should go down
+    regressions = []
+    baseline = flatten(baseline['results'])
+    for name, value in flatten(current['results']).items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if name.startswith('generation_seconds'):
+            slowdown = value / old - 1
+        else:
+            slowdown = old / value - 1
+        if slowdown > threshold:
+            regressions.append((name, old, value, slowdown))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the training throughput')
+    parser.add_argument('--output', default='benchmark.json', help='where to save the results')
+    parser.add_argument('--compare', metavar='BASELINE', help='results of an earlier run to check for slowdowns')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown that counts as a regression')
+    parser.add_argument('--sizes', type=int, nargs='+', default=POPULATION_SIZES, help='population sizes')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the generation benchmark')
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.sizes, args.workers)
+    for name, value in flatten(current['results']).items():
+        print(f'{name:40} {value:14.2f}')
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, old, new, slowdown in regressions:
+            print(f'SLOWER {name}: {old:.2f} -> {new:.2f} ({slowdown:+.0%})')
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
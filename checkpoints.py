@@ -0,0 +1,236 @@
+import copy
+import io
+import itertools
+import os
+import pickle
+import queue
+import random
+import re
+import threading
+import time
+
+import neat
+
+from files import write_file
+
+CHECKPOINT_DIR = 'checkpoints'
+STATE_FILE = re.compile(r'state-(\d+)\.p$')
+
+
+def new_run_directory(root=CHECKPOINT_DIR):
+    # Every training run keeps its checkpoints in its own directory, named after the time it started
+    directory = os.path.join(root, time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def latest_run_directory(root=CHECKPOINT_DIR, subdirectory=''):
+    # The latest run with checkpoints in the given subdirectory of its directory, like the directory of an island
+    runs = []
+    if os.path.isdir(root):
+        runs = sorted(run for run in os.listdir(root) if saved_generations(os.path.join(root, run, subdirectory)))
+    if not runs:
+        raise FileNotFoundError(f'No checkpoints in {root}')
+    return os.path.join(root, runs[-1])
+
+
+def saved_generations(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(match.group(1)) for match in map(STATE_FILE.match, os.listdir(directory)) if match)
+
+
+def state_path(directory, generation):
+    return os.path.join(directory, f'state-{generation:04d}.p')
+
+
+def genomes_path(directory, generation):
+    return os.path.join(directory, f'genomes-{generation:04d}.p')
+
+
+class StatePickler(pickle.Pickler):
+    # Pickles the state of a generation with every genome replaced by a reference, the genomes themselves are stored
+    # once, in the genomes file of the first generation that needed them
+    # A reference also holds the fitness, which is the only part of a genome that changes after it is created
+    def __init__(self, file, stored):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.stored = stored
+        self.new_genomes = {}
+        self.sources = {}
+        self.slots = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, neat.reporting.ReporterSet):
+            # The reporters can hold threads and files, the restored population brings its own
+            return 'reporters',
+        if isinstance(obj, neat.DefaultGenome):
+            if obj.key not in self.stored and obj.key not in self.new_genomes:
+                self.new_genomes[obj.key] = obj
+            self.sources[obj.key] = self.stored.get(obj.key)
+            slot = self.slots.setdefault(id(obj), len(self.slots))
+            return 'genome', obj.key, slot, obj.fitness
+        return None
+
+
+class StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, genomes):
+        super().__init__(file)
+        self.genomes = genomes
+        self.slots = {}
+
+    def persistent_load(self, pid):
+        if pid[0] == 'reporters':
+            return None
+        _, key, slot, fitness = pid
+        if slot not in self.slots:
+            genome = copy.copy(self.genomes[key])
+            genome.fitness = fitness
+            self.slots[slot] = genome
+        return self.slots[slot]
+
+
+class AsyncCheckpointer(neat.reporting.BaseReporter):
+    # Checkpoints the population every interval generations without holding up training
+    # Only the small state of a generation is pickled right away, the new genomes are pickled and everything is written
+    # to disk by a background thread. Genomes never change once created, so every genome is written once: each
+    # checkpoint stores the genomes that no earlier checkpoint has, and refers to the older ones
+    # The newest keep checkpoints are kept, genome files are deleted once none of them needs them anymore
+    # extra_state returns anything else to checkpoint with the population, like the hall of fame
+    def __init__(self, directory, interval=1, keep=5, extra_state=None):
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.extra_state = extra_state
+        self.generation = None
+        # Genome key -> generation of the genomes file holding it
+        self.stored = {}
+        # Generation of a checkpoint -> generations of the genomes files it needs
+        self.needs = {}
+        self.best_fitness = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+        self.jobs = queue.Queue()
+        self.writer = threading.Thread(target=self.write_jobs, name='checkpointer')
+        self.writer.start()
+
+    def load_index(self):
+        # Picks up the checkpoints already in the directory when resuming a run
+        for generation in saved_generations(self.directory):
+            with open(state_path(self.directory, generation), 'rb') as f:
+                sources = pickle.load(f)['sources']
+            self.needs[generation] = set(sources.values())
+            self.stored.update(sources)
+
+        best_path = os.path.join(self.directory, 'best.p')
+        if os.path.exists(best_path):
+            with open(best_path, 'rb') as f:
+                self.best_fitness = pickle.load(f).fitness
+
+    def write_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as error:
+                print(f'Checkpoint failed: {error!r}')
+
+    def close(self):
+        # Waits for everything queued so far to be written
+        self.jobs.put(None)
+        self.writer.join()
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        # The best genome of the run so far is saved every generation, it's small so it's pickled right away
+        if self.best_fitness is None or best_genome.fitness > self.best_fitness:
+            self.best_fitness = best_genome.fitness
+            data = pickle.dumps(best_genome, protocol=pickle.HIGHEST_PROTOCOL)
+            self.jobs.put(lambda: write_file(os.path.join(self.directory, 'best.p'), data))
+
+    def end_generation(self, config, population, species_set):
+        # The population passed here is the one the next generation will evaluate
+        generation = self.generation + 1
+        if generation % self.interval:
+            return
+
+        buffer = io.BytesIO()
+        pickler = StatePickler(buffer, self.stored)
+        extra = self.extra_state() if self.extra_state is not None else None
+        pickler.dump((population, species_set, extra))
+
+        # New node keys are handed out by the config, which isn't part of the checkpoint, so the next key is kept
+        # Reading it uses it up, the counter is replaced by one that starts from it again
+        genome_config = config.genome_config
+        next_node_key = None
+        if genome_config.node_indexer is not None:
+            next_node_key = next(genome_config.node_indexer)
+            genome_config.node_indexer = itertools.count(next_node_key)
+
+        new_genomes = pickler.new_genomes
+        sources = {key: generation if source is None else source for key, source in pickler.sources.items()}
+        self.stored.update((key, generation) for key in new_genomes)
+        self.needs[generation] = set(sources.values())
+        state = {
+            'generation': generation,
+            'sources': sources,
+            'state': buffer.getvalue(),
+            'random': random.getstate(),
+            'next_node_key': next_node_key,
+        }
+
+        # Only the checkpoints that are kept decide which genome files are still needed
+        dropped = sorted(self.needs)[:-self.keep]
+        for old in dropped:
+            del self.needs[old]
+        needed = set().union(*self.needs.values())
+        unused = sorted(set(self.stored.values()) - needed)
+        self.stored = {key: source for key, source in self.stored.items() if source in needed}
+
+        self.jobs.put(lambda: self.write_checkpoint(generation, new_genomes, state, dropped, unused))
+
+    def write_checkpoint(self, generation, new_genomes, state, dropped, unused):
+        if new_genomes:
+            write_file(genomes_path(self.directory, generation),
+                       pickle.dumps(new_genomes, protocol=pickle.HIGHEST_PROTOCOL))
+        write_file(state_path(self.directory, generation), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+        for old in dropped:
+            os.remove(state_path(self.directory, old))
+        for old in unused:
+            if os.path.exists(genomes_path(self.directory, old)):
+                os.remove(genomes_path(self.directory, old))
+
+
+def restore_checkpoint(config, directory, generation=None):
+    # Rebuilds the population of a checkpoint, the latest one by default, and returns it with the extra state
+    if generation is None:
+        generation = saved_generations(directory)[-1]
+    with open(state_path(directory, generation), 'rb') as f:
+        state = pickle.load(f)
+
+    genomes = {}
+    for source in sorted(set(state['sources'].values())):
+        with open(genomes_path(directory, source), 'rb') as f:
+            genomes.update(pickle.load(f))
+    population, species_set, extra = StateUnpickler(io.BytesIO(state['state']), genomes).load()
+    random.setstate(state['random'])
+    if state['next_node_key'] is not None:
+        config.genome_config.node_indexer = itertools.count(state['next_node_key'])
+
+    p = neat.Population(config, (population, species_set, state['generation']))
+    species_set.reporters = p.reporters
+    # neat restarts the genome keys from 1 when given a population, new genomes have to continue after the old ones
+    p.reproduction.genome_indexer = itertools.count(max(genomes) + 1)
+
+    best_path = os.path.join(directory, 'best.p')
+    if os.path.exists(best_path):
+        with open(best_path, 'rb') as f:
+            p.best_genome = pickle.load(f)
+
+    return p, extra
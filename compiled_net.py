@@ -0,0 +1,193 @@
+import neat
+import numpy as np
+
+# NumPy versions of the neat-python activation functions, for evaluating whole batches of inputs
+BATCH_ACTIVATIONS = {
+    'sigmoid': lambda z: 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0))),
+    'tanh': lambda z: np.tanh(np.clip(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: np.sin(np.clip(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: np.exp(-5.0 * np.clip(z, -3.4, 3.4) ** 2),
+    'relu': lambda z: np.where(z > 0.0, z, 0.0),
+    'identity': lambda z: z,
+    'clamped': lambda z: np.clip(z, -1.0, 1.0),
+    'exp': lambda z: np.exp(np.clip(z, -60.0, 60.0)),
+    'abs': np.abs,
+    'hat': lambda z: np.maximum(0.0, 1 - np.abs(z)),
+    'square': lambda z: z ** 2,
+    'cube': lambda z: z ** 3,
+}
+ACTIVATION_NAMES = sorted(BATCH_ACTIVATIONS)
+
+
+def batchable(genome):
+    # Whether the network of the genome can be put in a NetworkBatch, see CompiledNetwork
+    return all(node.aggregation == 'sum' and node.activation in BATCH_ACTIVATIONS for node in genome.nodes.values())
+
+
+class CompiledNetwork:
+    # Array form of a neat FeedForwardNetwork
+    # Every value of the network lives in a column: the inputs first, then the nodes in evaluation order and last a
+    # column that is always zero, used for outputs that nothing is connected to
+    # The links of a node are summed in the same order as neat does it, so the outputs match activate exactly
+    # Networks with other aggregations than sum or activations missing from BATCH_ACTIVATIONS are not batchable, they
+    # are only evaluated one set of inputs at a time and can't be put in a NetworkBatch
+    def __init__(self, input_nodes, nodes, output_nodes):
+        # nodes is a list of (node, activation name, activation function, aggregation name, aggregation function, bias,
+        # response, links) in evaluation order
+        num_inputs = len(input_nodes)
+        self.num_inputs = num_inputs
+        self.num_nodes = len(nodes)
+        self.zero_column = num_inputs + self.num_nodes
+        self.max_links = max([len(links) for *_, links in nodes], default=0)
+
+        columns = {node: i for i, node in enumerate(input_nodes)}
+        columns.update({node[0]: num_inputs + p for p, node in enumerate(nodes)})
+        self.output_columns = np.array([columns.get(node, self.zero_column) for node in output_nodes])
+        self.output_list = self.output_columns.tolist()
+
+        self.activations = [name for _, name, *_ in nodes]
+        self.aggregations = [aggregation for _, _, _, aggregation, *_ in nodes]
+        self.batchable = (all(name in BATCH_ACTIVATIONS for name in self.activations)
+                          and all(aggregation == 'sum' for aggregation in self.aggregations))
+        self.biases = np.array([bias for *_, bias, response, links in nodes], dtype=np.float64)
+        self.responses = np.array([response for *_, bias, response, links in nodes], dtype=np.float64)
+        self.link_columns = np.full((self.num_nodes, self.max_links), self.zero_column, dtype=np.int64)
+        self.link_weights = np.zeros((self.num_nodes, self.max_links), dtype=np.float64)
+        self.link_counts = [len(links) for *_, links in nodes]
+        self.node_evals = []
+        for p, (node, name, function, aggregation, aggregate, bias, response, links) in enumerate(nodes):
+            links = [(columns.get(i, self.zero_column), w) for i, w in links]
+            for k, (column, weight) in enumerate(links):
+                self.link_columns[p, k] = column
+                self.link_weights[p, k] = weight
+            # The builtin sum is what neat's sum aggregation calls, without the extra call
+            self.node_evals.append((function, sum if aggregation == 'sum' else aggregate, bias, response, links))
+
+    @staticmethod
+    def create(genome, config):
+        net = neat.nn.FeedForwardNetwork.create(genome, config)
+        nodes = []
+        for node, activation_function, aggregation_function, bias, response, links in net.node_evals:
+            node_gene = genome.nodes[node]
+            nodes.append((node, node_gene.activation, activation_function, node_gene.aggregation, aggregation_function,
+                          bias, response, links))
+
+        return CompiledNetwork(net.input_nodes, nodes, net.output_nodes)
+
+    def activate(self, inputs):
+        # Drop-in replacement for FeedForwardNetwork.activate, for a single set of inputs
+        if len(inputs) != self.num_inputs:
+            raise RuntimeError(f'Expected {self.num_inputs} inputs, got {len(inputs)}')
+
+        values = list(inputs) + [0.0] * (self.num_nodes + 1)
+        column = self.num_inputs
+        for function, aggregate, bias, response, links in self.node_evals:
+            values[column] = function(bias + response * aggregate([values[i] * w for i, w in links]))
+            column += 1
+
+        return [values[i] for i in self.output_list]
+
+    def activate_batch(self, inputs):
+        # Evaluates an array of shape (n, num_inputs) and returns the outputs with shape (n, num_outputs)
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if not self.batchable:
+            return np.array([self.activate(row) for row in inputs.tolist()], dtype=np.float64).reshape(
+                len(inputs), len(self.output_list))
+        values = np.zeros((len(inputs), self.zero_column + 1))
+        values[:, :self.num_inputs] = inputs
+        for p in range(self.num_nodes):
+            total = 0.0
+            for k in range(self.link_counts[p]):
+                total = total + values[:, self.link_columns[p, k]] * self.link_weights[p, k]
+            z = self.biases[p] + self.responses[p] * total
+            values[:, self.num_inputs + p] = BATCH_ACTIVATIONS[self.activations[p]](z)
+
+        return values[:, self.output_columns]
+
+
+class NetworkBatch:
+    # A fixed number of slots, each holding a different compiled network, all evaluated with the same array operations
+    # Networks smaller than the largest one are padded with links to the zero column and unused nodes
+    def __init__(self, slots, num_inputs, num_outputs, max_nodes, max_links):
+        self.slots = slots
+        self.num_inputs = num_inputs
+        self.max_nodes = max_nodes
+        self.max_links = max_links
+        self.zero_column = num_inputs + max_nodes
+        self.rows = np.arange(slots)
+
+        self.link_columns = np.full((slots, max_nodes, max_links), self.zero_column, dtype=np.int64)
+        self.link_weights = np.zeros((slots, max_nodes, max_links), dtype=np.float64)
+        self.biases = np.zeros((slots, max_nodes), dtype=np.float64)
+        self.responses = np.zeros((slots, max_nodes), dtype=np.float64)
+        # -1 marks padding nodes, whose value is never read so any activation will do
+        self.activations = np.full((slots, max_nodes), -1, dtype=np.int64)
+        self.node_activations = None
+        self.output_columns = np.full((slots, num_outputs), self.zero_column, dtype=np.int64)
+        self.values = np.zeros((slots, self.zero_column + 1), dtype=np.float64)
+        # Positions of the linked values in the flattened values array, so each node needs a single gather
+        self.flat_link_columns = self.link_columns + self.rows[:, None, None] * self.values.shape[1]
+
+    @staticmethod
+    def for_networks(slots, networks):
+        # A batch big enough for any of the given networks
+        networks = list(networks)
+        return NetworkBatch(slots, networks[0].num_inputs, len(networks[0].output_columns),
+                            max(net.num_nodes for net in networks), max(net.max_links for net in networks))
+
+    def set(self, slot, net):
+        if not net.batchable:
+            raise ValueError('Networks with aggregations other than sum or activations missing from '
+                             'BATCH_ACTIVATIONS can not be batched')
+        columns = np.where(net.link_columns == net.zero_column, self.zero_column, net.link_columns)
+        self.link_columns[slot] = self.zero_column
+        self.link_columns[slot, :net.num_nodes, :net.max_links] = columns
+        self.link_weights[slot] = 0.0
+        self.link_weights[slot, :net.num_nodes, :net.max_links] = net.link_weights
+        self.biases[slot] = 0.0
+        self.biases[slot, :net.num_nodes] = net.biases
+        self.responses[slot] = 0.0
+        self.responses[slot, :net.num_nodes] = net.responses
+        self.activations[slot] = -1
+        self.activations[slot, :net.num_nodes] = [ACTIVATION_NAMES.index(name) for name in net.activations]
+        self.node_activations = None
+        self.output_columns[slot] = np.where(net.output_columns == net.zero_column, self.zero_column,
+                                             net.output_columns)
+        self.flat_link_columns[slot] = self.link_columns[slot] + slot * self.values.shape[1]
+
+    def update_node_activations(self):
+        # For every node position the activations used by the slots, with the slots using each one
+        # A mask of None means the whole position uses the same activation, which is the common case
+        self.node_activations = []
+        for p in range(self.max_nodes):
+            codes = self.activations[:, p]
+            used = np.unique(codes[codes >= 0])
+            if len(used) <= 1:
+                name = ACTIVATION_NAMES[used[0]] if len(used) else 'identity'
+                self.node_activations.append([(BATCH_ACTIVATIONS[name], None)])
+            else:
+                self.node_activations.append([(BATCH_ACTIVATIONS[ACTIVATION_NAMES[code]], codes == code)
+                                              for code in used])
+
+    def activate(self, inputs):
+        # inputs has one row per slot, returns the outputs of every slot's network
+        if self.node_activations is None:
+            self.update_node_activations()
+
+        values = self.values
+        values[:, :self.num_inputs] = inputs
+        flat_values = values.reshape(-1)
+        for p in range(self.max_nodes):
+            weighted = flat_values[self.flat_link_columns[:, p]] * self.link_weights[:, p]
+            total = 0.0
+            for k in range(self.max_links):
+                total = total + weighted[:, k]
+            z = self.biases[:, p] + self.responses[:, p] * total
+
+            for function, mask in self.node_activations[p]:
+                if mask is None:
+                    values[:, self.num_inputs + p] = function(z)
+                else:
+                    values[mask, self.num_inputs + p] = function(z[mask])
+
+        return values[self.rows[:, None], self.output_columns]
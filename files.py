@@ -0,0 +1,9 @@
+import os
+
+
+def write_file(path, data):
+    # Written to a temporary file first and then renamed, so a crash while writing never leaves a broken file behind
+    # and readers either see the old file or the new one
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
@@ -1,100 +1,144 @@
-import pygame
+import os
 import random
-
-
-class Paddle:
-    def __init__(self, x, y):
-        self.length = 100
-        self.width = 20
-        self.original_x = x
-        self.original_y = y
-        self.rect = pygame.Rect(x - self.width // 2, y - self.length // 2, self.width, self.length)
-        self.vel = 7
-
-    def draw(self, win):
-        pygame.draw.rect(win, (255, 255, 255), self.rect)
-
-    def move(self, direction):
-        if direction == 'up':
-            self.rect.y -= self.vel
-
-        elif direction == 'down':
-            self.rect.y += self.vel
-
-    def reset(self):
-        self.rect.centerx = self.original_x
-        self.rect.centery = self.original_y
-
-
-class Ball:
-    def __init__(self, x, y):
-        self.radius = 15
-        self.max_vel = 7
-        self.x_vel = -self.max_vel
-        self.y_vel = 0
-        self.rect = pygame.Rect(x - self.radius // 2, y - self.radius // 2, self.radius, self.radius)
-
-    def draw(self, win):
-        pygame.draw.ellipse(win, (255, 255, 255), self.rect)
-
-    def move(self):
-        self.rect.x += self.x_vel
-        self.rect.y += self.y_vel
-
-    def reset(self):
-        self.rect.centerx = 800 // 2
-        self.rect.centery = 500 // 2
-        self.y_vel = random.randint(-3, 3)
+import pygame
+import simulation
+from batch_pong import predict_intercepts
+from model_registry import ModelRegistry
+from pong_env import observation_function, decide, genome_inputs, check_inputs
+from renderer import Renderer
+from replay import session_writer, match_state, paddle_move, rules_header
+from simulation import Paddle, Ball, GAME_RULES, TRAINING_RULES, move_paddle
 
 
 class Pong:
-    pygame.init()
     WIDTH = 800
     HEIGHT = 500
-    window = pygame.display.set_mode((WIDTH, HEIGHT))
-    clock = pygame.time.Clock()
-    pygame.display.set_caption('Pong')
+    # The window, fonts and sounds are only set up by init_display and init_audio, so importing the game is free
+    window = None
+    clock = None
     player1_score = 0
     player2_score = 0
     winning_score = 10
     winner = 0
-    score_font = pygame.font.SysFont('timesnewroman', 50)
-    win_msg_font = pygame.font.SysFont('timesnewroman', 60)
-    title_font = pygame.font.SysFont('timesnewroman', 80)
-    button_font = pygame.font.SysFont('timesnewroman', 45)
-    bg_music = pygame.mixer.Sound('SFX/music.wav')
-    bg_music.set_volume(0.4)
-    bg_music.play(loops=-1)
-    score_sfx = pygame.mixer.Sound('SFX/ding.wav')
-    wall_sfx = pygame.mixer.Sound('SFX/pong.wav')
-    paddle_sfx = pygame.mixer.Sound('SFX/ping.wav')
+    score_font = None
+    win_msg_font = None
+    title_font = None
+    button_font = None
+    label_font = None
+    bg_music = None
+    score_sfx = None
+    wall_sfx = None
+    paddle_sfx = None
+    # Draws the game frames, and the buttons of the menus, drawn once by init_display
+    renderer = None
+    buttons = None
+    # What the window shows, so the menus are only drawn when it changes, None when it has to be drawn again
+    screen = None
     game_active = False
     game_over = False
     pvp = False
     PADDLE_OFFSET = 25
+    RULES = GAME_RULES
+    # Networks play under the rules they were trained with, like testing.evaluate
+    NETWORK_RULES = TRAINING_RULES
+    # The rules of the game being played, chosen when it starts
+    rules = RULES
     paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
     paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
-    ball = Ball(WIDTH // 2, HEIGHT // 2)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, rules=RULES)
+
+    # The physics always advance in steps of 1 / TICK_RATE seconds, however fast the frames are drawn. A frame runs as
+    # many steps as the time since the last frame covers, times SPEED, but at most MAX_STEPS_PER_FRAME per unit of
+    # SPEED so a slow frame can't snowball. SPEED above 1 runs the game faster than real time, e.g. for AI vs. AI
+    # Frames are drawn at FRAME_RATE, the refresh rate of the display when pygame can tell, with every object drawn in
+    # between where it was on the last two steps
+    TICK_RATE = 60
+    FRAME_RATE = 60
+    SPEED = 1.0
+    MAX_STEPS_PER_FRAME = 5
+    # Milliseconds of game time so far, the computer's reaction delay is measured in it
+    time = 0
+    # Where the paddles and the ball were before the last step
+    previous_positions = None
 
     last_hit_time = 0
     AI_LEVEL = 7
     AI_MOVE_DELAY = 500
-
-    def draw_window(self, win, paddle1, paddle2, ball, player1_score, player2_score,draw_trajectory=False):
-        win.fill('black')
-        pygame.draw.line(win, (255, 255, 255), (self.WIDTH // 2, 0), (self.WIDTH // 2, self.HEIGHT), 3)
-
-        score1_text = self.score_font.render(f'{player1_score}', True, (255, 255, 255))
-        score2_text = self.score_font.render(f'{player2_score}', True, (255, 255, 255))
-        win.blit(score1_text, (self.WIDTH // 2 - score1_text.get_width() - 20, 10))
-        win.blit(score2_text, (self.WIDTH // 2 + 20, 10))
-        paddle1.draw(win)
-        paddle2.draw(win)
+    # Where the ball will cross the computer's paddle, only recalculated after the ball's velocity changes
+    predicted_y = None
+
+    # Trained networks to play against, the latest version of every model in the registry, or winner.p if there are
+    # none. They are compiled once when the start screen is first shown, so switching between them is instant
+    opponents = None
+    selected_opponent = 0
+    # The network the computer's paddle is playing with, None for comp_paddle_movement, and the inputs it's given
+    network = None
+    observe = None
+    # The paddle speed the networks were trained with
+    NETWORK_VEL = 7
+
+    # Every game is recorded to a replay file of its own in REPLAY_DIR while it's played, replay.py plays them back
+    RECORD_REPLAYS = True
+    REPLAY_DIR = 'replays'
+    recording = None
+
+    def init_display(self):
+        if self.window is None:
+            pygame.init()
+            self.window = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+            self.clock = pygame.time.Clock()
+            pygame.display.set_caption('Pong')
+            refresh_rates = getattr(pygame.display, 'get_desktop_refresh_rates', lambda: [])()
+            if refresh_rates and refresh_rates[0] > 0:
+                self.FRAME_RATE = refresh_rates[0]
+            self.score_font = pygame.font.SysFont('timesnewroman', 50)
+            self.win_msg_font = pygame.font.SysFont('timesnewroman', 60)
+            self.title_font = pygame.font.SysFont('timesnewroman', 80)
+            self.button_font = pygame.font.SysFont('timesnewroman', 45)
+            self.label_font = pygame.font.SysFont('timesnewroman', 25)
+            self.renderer = Renderer(self.window)
+            self.buttons = {}
+
+    def init_audio(self):
+        if self.bg_music is None:
+            pygame.mixer.init()
+            self.bg_music = pygame.mixer.Sound('SFX/music.wav')
+            self.bg_music.set_volume(0.4)
+            self.bg_music.play(loops=-1)
+            self.score_sfx = pygame.mixer.Sound('SFX/ding.wav')
+            self.wall_sfx = pygame.mixer.Sound('SFX/pong.wav')
+            self.paddle_sfx = pygame.mixer.Sound('SFX/ping.wav')
+
+    def play_sfx(self, sfx):
+        # Sounds are skipped until init_audio has loaded them
+        if sfx is not None:
+            sfx.play()
+
+    def interpolated_rect(self, obj, previous, alpha):
+        x, y = previous
+        return (x + (obj.rect.x - x) * alpha, y + (obj.rect.y - y) * alpha, obj.rect.width, obj.rect.height)
+
+    def draw_window(self, win, paddle1, paddle2, ball, player1_score, player2_score,draw_trajectory=False, alpha=1.0):
+        # alpha is how far the frame is from the previous step to the last one
+        rects = [None, None, None]
+        if self.previous_positions is not None and alpha < 1.0:
+            rects = [self.interpolated_rect(obj, previous, alpha)
+                     for obj, previous in zip((paddle1, paddle2, ball), self.previous_positions)]
+
+        renderer = self.renderer
+        renderer.begin()
+        score1_text = renderer.text(self.score_font, f'{player1_score}')
+        score2_text = renderer.text(self.score_font, f'{player2_score}')
+        renderer.blit(score1_text, (self.WIDTH // 2 - score1_text.get_width() - 20, 10))
+        renderer.blit(score2_text, (self.WIDTH // 2 + 20, 10))
+        renderer.mark(paddle1.draw(win, rects[0]))
+        renderer.mark(paddle2.draw(win, rects[1]))
         if draw_trajectory:
             self.calculate_trajectory(ball, True)
-        ball.draw(win)
+        renderer.mark(ball.draw(win, rects[2]))
 
-        pygame.display.update()
+        renderer.end()
+        self.screen = 'game'
 
     def paddle_movement(self, paddle1, paddle2):
         keys = pygame.key.get_pressed()
@@ -145,90 +189,136 @@ class Pong:
                                                                          ball.x_vel, ball.y_vel)
         # Draw the first line
         if draw:
-            pygame.draw.line(self.window, (255, 0, 0), (ball.rect.centerx, ball.rect.centery), (new_x, new_y), 3)
+            self.renderer.mark(pygame.draw.line(self.window, (255, 0, 0), (ball.rect.centerx, ball.rect.centery),
+                                                (new_x, new_y), 3))
 
-        # If ball hits the top or bottom we draw another line and pass the new_x and new_y as starting coordinates
+        # Every time the ball hits the top or bottom we draw another line starting where the last one ended
         # The y_vel is negated because the ball changes direction if hit top or bottom
-        if hit_top_or_bottom:
-            new_x2, new_y2, _ = self.calculate_new_coordinates(new_x, new_y, ball.x_vel, -ball.y_vel)
+        y_vel = ball.y_vel
+        while hit_top_or_bottom:
+            y_vel = -y_vel
+            new_x2, new_y2, hit_top_or_bottom = self.calculate_new_coordinates(new_x, new_y, ball.x_vel, y_vel)
             if draw:
-                pygame.draw.line(self.window, (255, 0, 0), (new_x, new_y), (new_x2, new_y2), 3)
-            return new_y2
+                self.renderer.mark(pygame.draw.line(self.window, (255, 0, 0), (new_x, new_y), (new_x2, new_y2), 3))
+            new_x, new_y = new_x2, new_y2
 
         return new_y
 
+    def predict_intercept(self, ball):
+        # Where the center of the ball will be when it reaches the paddle it's moving towards, for any number of bounces
+        # Exact for the rules of the game, unlike calculate_trajectory which only draws the rough path
+        return predict_intercepts(ball.rect.x, ball.rect.y, ball.x_vel, ball.y_vel, self.rules).item()
+
     def comp_paddle_movement(self, paddle2, ball):
-        current_time = pygame.time.get_ticks()
-        if current_time - self.last_hit_time >= self.AI_MOVE_DELAY:
-            ball_trajectory_y = self.calculate_trajectory(ball)
+        if self.time - self.last_hit_time >= self.AI_MOVE_DELAY:
+            if self.predicted_y is None:
+                self.predicted_y = self.predict_intercept(ball)
+            ball_trajectory_y = self.predicted_y
             if ball_trajectory_y < paddle2.rect.centery - 5 and paddle2.rect.top > 0:
                 paddle2.move('up')
             elif ball_trajectory_y > paddle2.rect.centery + 5 and paddle2.rect.bottom < self.HEIGHT:
                 paddle2.move('down')
 
     def handle_collisions(self, ball, paddle1, paddle2):
-        # Check for collisions with wall
-        if ball.rect.top <= 0 or ball.rect.bottom + ball.y_vel >= self.HEIGHT:
-            ball.y_vel = -ball.y_vel
-            self.wall_sfx.play()
+        events = simulation.handle_collisions(ball, paddle1, paddle2, self.rules)
 
-        # Check for collisions on left and right sides
-        if ball.rect.right <= 0:
-            self.player2_score += 1
-            ball.reset()
-            ball.x_vel = ball.max_vel
-            self.score_sfx.play()
+        # Every event changes the ball's velocity, so the computer has to predict again
+        if events:
+            self.predicted_y = None
 
-        elif ball.rect.left >= self.WIDTH:
-            self.player1_score += 1
-            ball.reset()
-            ball.x_vel = -ball.max_vel
-            self.score_sfx.play()
-
-        if ball.x_vel < 0:
-            if paddle1.rect.y <= ball.rect.centery <= paddle1.rect.bottom + 5:
-                if paddle1.rect.x + paddle1.width >= ball.rect.x:
-                    ball.x_vel = -ball.x_vel
-
-                    y_difference = paddle1.rect.centery - ball.rect.centery
-                    y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                    ball.y_vel = -y_vel
-                    self.last_hit_time = pygame.time.get_ticks()
-                    self.paddle_sfx.play()
-        else:
-            if paddle2.rect.y <= ball.rect.centery <= paddle2.rect.bottom + 5:
-                if paddle2.rect.x <= ball.rect.centerx + ball.radius:
-                    ball.x_vel = -ball.x_vel
+        if events & simulation.WALL:
+            self.play_sfx(self.wall_sfx)
 
-                    y_difference = paddle2.rect.centery - ball.rect.centery
-                    y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                    ball.y_vel = -y_vel
-                    self.last_hit_time = pygame.time.get_ticks()
-                    self.paddle_sfx.play()
+        # The ball jumps back to the middle after a score, it shouldn't be drawn flying across the screen
+        if events & (simulation.SCORE_LEFT | simulation.SCORE_RIGHT):
+            self.previous_positions = None
 
-    def draw_start_screen(self, win):
-        win.fill('black')
-        game_name = self.title_font.render('Pong', True, (255, 255, 255))
-        game_name_rect = game_name.get_rect(center=(self.WIDTH // 2, 100))
-        win.blit(game_name, game_name_rect)
-
-        pvp_button = pygame.Surface((225, 60))
-        pvp_button.fill('White')
-        pvp_button_rect = pvp_button.get_rect(center=(self.WIDTH // 2, 275))
-        win.blit(pvp_button, pvp_button_rect)
-
-        pvp_text = self.button_font.render('Vs. Player', True, (0, 0, 0))
-        pvp_text_rect = pvp_text.get_rect(center=(self.WIDTH // 2, 275))
-        win.blit(pvp_text, pvp_text_rect)
-
-        pvc_button = pygame.Surface((215, 60))
-        pvc_button.fill('White')
-        pvc_button_rect = pvc_button.get_rect(center=(self.WIDTH // 2, 375))
-        win.blit(pvc_button, pvc_button_rect)
+        if events & simulation.SCORE_RIGHT:
+            self.player2_score += 1
+            self.play_sfx(self.score_sfx)
+        elif events & simulation.SCORE_LEFT:
+            self.player1_score += 1
+            self.play_sfx(self.score_sfx)
+
+        if events & (simulation.HIT_LEFT | simulation.HIT_RIGHT):
+            self.last_hit_time = self.time
+            self.play_sfx(self.paddle_sfx)
+
+    def load_opponents(self):
+        self.opponents = []
+        registry = ModelRegistry()
+        for name in registry.names():
+            version = registry.latest(name)
+            try:
+                self.opponents.append((f'{name}:{version}', registry.load(name, version)))
+            except ValueError as error:
+                # Trained with other inputs than the game gives the networks
+                print(f'Skipping {name}:{version}: {error}')
+
+        if not self.opponents and os.path.exists('winner.p'):
+            import pickle
+            import neat
+            from compiled_net import CompiledNetwork
+            config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                                 neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                                 'config.txt')
+            with open('winner.p', 'rb') as f:
+                winner = pickle.load(f)
+            try:
+                check_inputs(*genome_inputs(winner), 'winner.p')
+                self.opponents.append(('winner.p', CompiledNetwork.create(winner, config)))
+            except ValueError as error:
+                print(f'Skipping winner.p: {error}')
+
+    def select_opponent(self, step):
+        if self.opponents:
+            self.selected_opponent = (self.selected_opponent + step) % len(self.opponents)
+
+    def network_paddle_movement(self, paddle1, paddle2, ball):
+        # Same inputs and decisions as in training
+        move_paddle(paddle2, decide(self.network.activate(self.observe(paddle2, paddle1, ball))))
+
+    def button(self, size, text):
+        # Buttons are drawn once, with their text, and reused
+        key = (size, text)
+        if key not in self.buttons:
+            button = pygame.Surface(size)
+            button.fill('White')
+            button_text = self.button_font.render(text, True, (0, 0, 0))
+            button.blit(button_text, button_text.get_rect(center=(size[0] // 2, size[1] // 2)))
+            self.buttons[key] = button
+        return self.buttons[key]
 
-        pvc_text = self.button_font.render('Vs. Comp', True, (0, 0, 0))
-        pvc_text_rect = pvc_text.get_rect(center=(self.WIDTH // 2, 375))
-        win.blit(pvc_text, pvc_text_rect)
+    def draw_start_screen(self, win):
+        if self.opponents is None:
+            self.load_opponents()
+
+        pvp_button = self.button((225, 60), 'Vs. Player')
+        pvp_button_rect = pvp_button.get_rect(center=(self.WIDTH // 2, 230))
+        pvc_button = self.button((215, 60), 'Vs. Comp')
+        pvc_button_rect = pvc_button.get_rect(center=(self.WIDTH // 2, 310))
+        pva_button = self.button((215, 60), 'Vs. AI')
+        pva_button_rect = pva_button.get_rect(center=(self.WIDTH // 2, 390))
+
+        # The left and right arrow keys pick the network to play against
+        if self.opponents:
+            label = f'<   {self.opponents[self.selected_opponent][0]}   >'
+        else:
+            label = 'No trained networks'
+
+        # The screen is only drawn again when something on it changed
+        if self.screen != ('start', label):
+            win.fill('black')
+            game_name = self.renderer.text(self.title_font, 'Pong')
+            win.blit(game_name, game_name.get_rect(center=(self.WIDTH // 2, 100)))
+            win.blit(pvp_button, pvp_button_rect)
+            win.blit(pvc_button, pvc_button_rect)
+            win.blit(pva_button, pva_button_rect)
+            opponent_text = self.renderer.text(self.label_font, label)
+            win.blit(opponent_text, opponent_text.get_rect(center=(self.WIDTH // 2, 450)))
+            pygame.display.update()
+            self.screen = ('start', label)
+            self.renderer.invalidate()
 
         game_active = False
         pvp = None
@@ -241,8 +331,13 @@ class Pong:
             if pvc_button_rect.collidepoint(mouse_pos):
                 game_active = True
                 pvp = False
+                self.network = None
+            if pva_button_rect.collidepoint(mouse_pos) and self.opponents:
+                game_active = True
+                pvp = False
+                self.network = self.opponents[self.selected_opponent][1]
+                self.observe = observation_function()
 
-        pygame.display.update()
         return game_active, pvp
 
     def draw_win_message(self, win, winner):
@@ -253,28 +348,20 @@ class Pong:
             msg_pos_x = self.WIDTH // 2 + 200
             button_pos_x = self.WIDTH // 2 + 200
 
-        win_msg = self.win_msg_font.render('Win!', True, (255, 255, 255))
-        win_msg_rect = win_msg.get_rect(center=(msg_pos_x, 150))
-
-        win.blit(win_msg, win_msg_rect)
-
-        restart_button = pygame.Surface((175, 50))
-        restart_button.fill('White')
+        restart_button = self.button((175, 50), 'Restart')
         restart_button_rect = restart_button.get_rect(center=(button_pos_x, 300))
-        win.blit(restart_button, restart_button_rect)
-
-        restart_text = self.button_font.render('Restart', True, (0, 0, 0))
-        restart_text_rect = restart_text.get_rect(center=(button_pos_x, 300))
-        win.blit(restart_text, restart_text_rect)
-
-        main_menu_button = pygame.Surface((250, 50))
-        main_menu_button.fill('White')
+        main_menu_button = self.button((250, 50), 'Main Menu')
         main_menu_button_rect = main_menu_button.get_rect(center=(button_pos_x, 375))
-        win.blit(main_menu_button, main_menu_button_rect)
 
-        main_menu_text = self.button_font.render('Main Menu', True, (0, 0, 0))
-        main_menu_text_rect = main_menu_text.get_rect(center=(button_pos_x, 375))
-        win.blit(main_menu_text, main_menu_text_rect)
+        # Drawn once over the last frame of the game
+        if self.screen != ('win', winner):
+            win_msg = self.renderer.text(self.win_msg_font, 'Win!')
+            win.blit(win_msg, win_msg.get_rect(center=(msg_pos_x, 150)))
+            win.blit(restart_button, restart_button_rect)
+            win.blit(main_menu_button, main_menu_button_rect)
+            pygame.display.update()
+            self.screen = ('win', winner)
+            self.renderer.invalidate()
 
         restart = False
         main_menu = False
@@ -286,52 +373,118 @@ class Pong:
             if main_menu_button_rect.collidepoint(mouse_pos):
                 main_menu = True
 
-        pygame.display.update()
         return restart, main_menu
 
     def reset(self):
+        self.previous_positions = None
         self.game_over = False
         self.player1_score = 0
         self.player2_score = 0
         self.paddle1.reset()
         self.paddle2.reset()
+        for paddle in (self.paddle1, self.paddle2):
+            paddle.score = 0
+            paddle.hits = 0
+
+    def start_recording(self):
+        # The ball gets a generator of its own, seeded now, so the serves of the game can be played back
+        seed = random.getrandbits(32)
+        self.ball.rng = random.Random(seed)
+        if self.pvp:
+            opponent = 'player'
+        elif self.network is not None:
+            opponent = self.opponents[self.selected_opponent][0]
+        else:
+            opponent = f'computer AI_LEVEL {self.AI_LEVEL}'
+
+        self.recording = session_writer(self.REPLAY_DIR, 'game')
+        header = {'seed': seed, 'left': 'player', 'right': opponent,
+                  'state': match_state(self.paddle1, self.paddle2, self.ball)}
+        header.update(rules_header(self.rules))
+        self.recording.start(header)
+
+    def stop_recording(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    def step(self):
+        # One tick of the game
+        if self.RECORD_REPLAYS and self.recording is None:
+            self.start_recording()
+        self.previous_positions = [(obj.rect.x, obj.rect.y) for obj in (self.paddle1, self.paddle2, self.ball)]
+        paddle1_y, paddle2_y = self.paddle1.rect.y, self.paddle2.rect.y
+        self.time += 1000 / self.TICK_RATE
+
+        if self.pvp:
+            # Moving the paddles
+            self.paddle_movement(self.paddle1, self.paddle2)
+
+            # Move the ball
+            self.ball.move()
+
+            # Handling collisions
+            self.handle_collisions(self.ball, self.paddle1, self.paddle2)
+
+        else:
+            self.player1_paddle_movement(self.paddle1)
+            if self.network is None:
+                self.comp_paddle_movement(self.paddle2, self.ball)
+            else:
+                self.network_paddle_movement(self.paddle1, self.paddle2, self.ball)
+            self.ball.move()
+            self.handle_collisions(self.ball, self.paddle1, self.paddle2)
+
+        # Only the paddles move before the ball, so how they moved is all a replay needs of the tick
+        if self.recording is not None:
+            self.recording.tick(paddle_move(self.paddle1, paddle1_y), paddle_move(self.paddle2, paddle2_y))
+
+        if self.player1_score == self.winning_score:
+            self.game_over = True
+            self.winner = 1
+
+        elif self.player2_score == self.winning_score:
+            self.game_over = True
+            self.winner = 2
+
+        if self.game_over:
+            self.stop_recording()
 
     def run(self):
+        self.init_display()
+        self.init_audio()
+        step_time = 1 / self.TICK_RATE
+        accumulator = 0.0
         while True:
-            self.clock.tick(60)
+            frame_time = self.clock.tick(self.FRAME_RATE) / 1000
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    self.stop_recording()
                     pygame.quit()
                     quit()
+                if event.type == pygame.WINDOWEXPOSED:
+                    self.screen = None
+                    self.renderer.invalidate()
+                if event.type == pygame.KEYDOWN and not self.game_active:
+                    if event.key == pygame.K_LEFT:
+                        self.select_opponent(-1)
+                    elif event.key == pygame.K_RIGHT:
+                        self.select_opponent(1)
 
             if self.game_active:
                 if not self.game_over:
-                    if self.pvp:
-                        # Moving the paddles
-                        self.paddle_movement(self.paddle1, self.paddle2)
-
-                        # Move the ball
-                        self.ball.move()
-
-                        # Handling collisions
-                        self.handle_collisions(self.ball, self.paddle1, self.paddle2)
-
-                    else:
-                        self.player1_paddle_movement(self.paddle1)
-                        self.comp_paddle_movement(self.paddle2, self.ball)
-                        self.ball.move()
-                        self.handle_collisions(self.ball, self.paddle1, self.paddle2)
+                    accumulator += frame_time * self.SPEED
+                    steps = 0
+                    max_steps = self.MAX_STEPS_PER_FRAME * max(self.SPEED, 1)
+                    while accumulator >= step_time and steps < max_steps and not self.game_over:
+                        self.step()
+                        accumulator -= step_time
+                        steps += 1
+                    # Time the steps couldn't catch up with is dropped
+                    accumulator %= step_time
 
                     self.draw_window(self.window, self.paddle1, self.paddle2, self.ball, self.player1_score,
-                                     self.player2_score,draw_trajectory=False)
-
-                    if self.player1_score == self.winning_score:
-                        self.game_over = True
-                        self.winner = 1
-
-                    elif self.player2_score == self.winning_score:
-                        self.game_over = True
-                        self.winner = 2
+                                     self.player2_score,draw_trajectory=False, alpha=accumulator / step_time)
 
                 else:
                     restart, main_menu = self.draw_win_message(self.window, self.winner)
@@ -343,9 +496,15 @@ class Pong:
                         self.reset()
 
             else:
+                accumulator = 0.0
                 self.game_active, self.pvp = self.draw_start_screen(self.window)
                 if not self.pvp and self.pvp is not None:
-                    self.paddle2.vel = self.AI_LEVEL
+                    self.paddle2.vel = self.AI_LEVEL if self.network is None else self.NETWORK_VEL
+                if self.game_active:
+                    # A new ball, serving like the first serve of the rules
+                    self.rules = self.NETWORK_RULES if not self.pvp and self.network is not None else self.RULES
+                    self.ball = Ball(self.WIDTH // 2, self.HEIGHT // 2, rules=self.rules)
+                    self.previous_positions = None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+import copy
+import itertools
+
+import neat
+
+
+def adopt(population, genome):
+    # A copy of a genome from another island that fits into this one: its key and the keys of its hidden nodes are
+    # handed out by this island, so they can't clash with genomes and nodes that evolved here
+    genome_config = population.config.genome_config
+    if genome_config.node_indexer is None:
+        keys = [key for member in population.population.values() for key in member.nodes]
+        genome_config.node_indexer = itertools.count(max(keys) + 1)
+
+    outputs = set(genome_config.output_keys)
+    renamed = {key: key if key in outputs else next(genome_config.node_indexer) for key in genome.nodes}
+
+    migrant = copy.deepcopy(genome)
+    migrant.key = next(population.reproduction.genome_indexer)
+    migrant.fitness = None
+    migrant.nodes = {}
+    for key, node in genome.nodes.items():
+        node = copy.deepcopy(node)
+        node.key = renamed[key]
+        migrant.nodes[node.key] = node
+    migrant.connections = {}
+    for (i, o), connection in genome.connections.items():
+        connection = copy.deepcopy(connection)
+        # Inputs have negative keys and are the same on every island
+        connection.key = (renamed.get(i, i), renamed.get(o, o))
+        migrant.connections[connection.key] = connection
+    return migrant
+
+
+class MigrationReporter(neat.reporting.BaseReporter):
+    # Swaps genomes between islands every interval generations. Every island sends copies of its fittest genomes to the
+    # coordinator and waits for the migrants it gets back, which replace its newest offspring
+    def __init__(self, population, index, interval, migrants, inbox, reports):
+        self.population = population
+        self.index = index
+        self.interval = interval
+        self.migrants = migrants
+        self.inbox = inbox
+        self.reports = reports
+        self.generation = None
+        self.fittest = []
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        ranked = sorted(population.values(), key=lambda genome: genome.fitness, reverse=True)
+        self.fittest = [copy.deepcopy(genome) for genome in ranked[:self.migrants]]
+
+    def end_generation(self, config, population, species_set):
+        if (self.generation + 1) % self.interval:
+            return
+
+        self.reports.put(('migrants', self.index, self.generation, self.fittest))
+        arrivals = self.inbox.get()
+        if not arrivals:
+            return
+
+        # The population is the one the next generation will evaluate, it's split into species again with the migrants
+        for old_key, genome in zip(sorted(population, reverse=True), arrivals):
+            del population[old_key]
+            migrant = adopt(self.population, genome)
+            population[migrant.key] = migrant
+        species_set.speciate(config, population, self.generation)
+
+
+def route_migrants(migrations, alive, inboxes):
+    # Hands out the migrants of a generation once every island still running has sent them, the islands form a ring
+    # and every island gets the migrants of the one before it. Waiting for all of them keeps the exchange the same on
+    # every run. migrations maps generations to the migrants of every island that sent them
+    for generation in sorted(migrations):
+        senders = sorted(migrations[generation])
+        if not alive <= set(senders):
+            continue
+        for k, index in enumerate(senders):
+            previous = senders[k - 1]
+            inboxes[index].put(migrations[generation][previous] if previous != index else [])
+        del migrations[generation]
+
+
+class IslandReporter(neat.reporting.BaseReporter):
+    # Sends how an island is doing to the coordinator every generation, with its best genome whenever it improved
+    def __init__(self, index, reports):
+        self.index = index
+        self.reports = reports
+        self.generation = None
+        self.best_fitness = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        fitnesses = [genome.fitness for genome in population.values()]
+        improved = self.best_fitness is None or best_genome.fitness > self.best_fitness
+        if improved:
+            self.best_fitness = best_genome.fitness
+        self.reports.put(('generation', self.index, self.generation, best_genome.fitness,
+                          sum(fitnesses) / len(fitnesses), len(species.species), best_genome if improved else None))
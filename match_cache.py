@@ -0,0 +1,66 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+from files import write_file
+
+
+def genome_fingerprint(genome):
+    # Hash of everything in the genome that affects how its network plays, two genomes with the same fingerprint
+    # always make the same decisions
+    nodes = sorted((key, node.bias, node.response, node.activation, node.aggregation)
+                   for key, node in genome.nodes.items())
+    connections = sorted((key, connection.weight)
+                         for key, connection in genome.connections.items() if connection.enabled)
+    return hashlib.blake2b(repr((nodes, connections)).encode(), digest_size=16).hexdigest()
+
+
+class MatchCache:
+    # Remembers the fitness both sides got in a match, keyed by (left fingerprint, right fingerprint, seed)
+    # Holds at most max_size results and drops the least recently used ones first
+    # context describes the rules the results were played under, a saved cache with a different context is ignored
+    def __init__(self, max_size=200000, path=None, context=''):
+        self.max_size = max_size
+        self.path = path
+        self.context = context
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, key):
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            context, results = pickle.load(f)
+        if context == self.context:
+            self.results = OrderedDict(list(results.items())[-self.max_size:])
+
+    def save(self):
+        # Written with write_file, so a crash while saving doesn't lose the old cache
+        if self.path is None:
+            return
+
+        write_file(self.path, pickle.dumps((self.context, self.results), protocol=pickle.HIGHEST_PROTOCOL))
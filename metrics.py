@@ -0,0 +1,193 @@
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+
+import neat
+
+from checkpoints import CHECKPOINT_DIR
+
+METRICS_FILE = 'metrics.jsonl'
+# The lines of finished generations are written out at most this often, a crash loses at most that much of the file
+FLUSH_SECONDS = 30.0
+
+
+def quantile(ordered, fraction):
+    # Linear interpolation between the closest ranks of a sorted list
+    position = (len(ordered) - 1) * fraction
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class MetricsReporter(neat.reporting.BaseReporter):
+    # Appends a JSON line about every generation to a file: the fitness distribution, the species, the size of the
+    # genomes, how many matches were played and ticks simulated, and how long evaluating the generation took
+    # counters returns the counts of whatever the generation did since it was last called, like
+    # training.take_match_counts
+    # A resumed run appends the generations it plays again after the ones it wrote before, the last line of a
+    # generation is the one that counts
+    def __init__(self, path, counters=None, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.counters = counters
+        self.flush_seconds = flush_seconds
+        self.lines = []
+        self.last_flush = time.monotonic()
+        self.generation = None
+        self.generation_start = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.generation_start = time.perf_counter()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        eval_seconds = time.perf_counter() - self.generation_start
+        fitnesses = sorted(genome.fitness for genome in population.values())
+        sizes = [genome.size() for genome in population.values()]
+        metrics = {
+            'generation': self.generation,
+            'time': round(time.time(), 3),
+            'eval_seconds': round(eval_seconds, 4),
+            'population': len(fitnesses),
+            'fitness': {
+                'max': fitnesses[-1],
+                'mean': statistics.fmean(fitnesses),
+                'stdev': statistics.pstdev(fitnesses),
+                'min': fitnesses[0],
+                'quartiles': [quantile(fitnesses, fraction) for fraction in (0.25, 0.5, 0.75)],
+            },
+            'species': len(species.species),
+            'species_sizes': sorted((len(s.members) for s in species.species.values()), reverse=True),
+            'nodes': {'mean': statistics.fmean(nodes for nodes, _ in sizes), 'max': max(nodes for nodes, _ in sizes)},
+            'connections': {'mean': statistics.fmean(connections for _, connections in sizes),
+                            'max': max(connections for _, connections in sizes)},
+            'best': {'key': best_genome.key, 'nodes': best_genome.size()[0], 'connections': best_genome.size()[1]},
+        }
+        if self.counters is not None:
+            metrics.update(self.counters())
+        self.lines.append(json.dumps(metrics, separators=(',', ':')))
+
+        if time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+
+def read_metrics(path):
+    # The metrics of every generation of a run, in order, with the last line of generations written more than once
+    generations = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                metrics = json.loads(line)
+                generations[metrics['generation']] = metrics
+    return [generations[generation] for generation in sorted(generations)]
+
+
+def metrics_files(directory):
+    # The metrics of a run, or of every island of it
+    if os.path.exists(os.path.join(directory, METRICS_FILE)):
+        return [os.path.join(directory, METRICS_FILE)]
+    return [os.path.join(directory, name, METRICS_FILE) for name in sorted(os.listdir(directory))
+            if os.path.exists(os.path.join(directory, name, METRICS_FILE))]
+
+
+def latest_run(root=CHECKPOINT_DIR):
+    runs = []
+    if os.path.isdir(root):
+        runs = sorted(run for run in os.listdir(root) if metrics_files(os.path.join(root, run)))
+    if not runs:
+        raise FileNotFoundError(f'No metrics in {root}')
+    return os.path.join(root, runs[-1])
+
+
+def summarize(generations, every=1):
+    # Prints a table of the generations and the totals of the run
+    print(f'{"gen":>5} {"best":>9} {"mean":>9} {"median":>9} {"species":>7} {"nodes":>6} {"conns":>6} '
+          f'{"matches":>8} {"ticks":>10} {"eval s":>8} {"ticks/s":>9}')
+    for metrics in generations:
+        if metrics['generation'] % every and metrics is not generations[-1]:
+            continue
+        fitness = metrics['fitness']
+        ticks = metrics.get('ticks', 0)
+        print(f'{metrics["generation"]:5d} {fitness["max"]:9.1f} {fitness["mean"]:9.1f} {fitness["quartiles"][1]:9.1f}'
+              f' {metrics["species"]:7d} {metrics["nodes"]["mean"]:6.1f} {metrics["connections"]["mean"]:6.1f}'
+              f' {metrics.get("matches", 0):8d} {ticks:10d} {metrics["eval_seconds"]:8.2f}'
+              f' {ticks / metrics["eval_seconds"] if metrics["eval_seconds"] else 0:9.0f}')
+
+    eval_seconds = sum(metrics['eval_seconds'] for metrics in generations)
+    ticks = sum(metrics.get('ticks', 0) for metrics in generations)
+    matches = sum(metrics.get('matches', 0) for metrics in generations)
+    cached = sum(metrics.get('cached', 0) for metrics in generations)
+    best = max(generations, key=lambda metrics: metrics['fitness']['max'])
+    wall = generations[-1]['time'] - generations[0]['time'] + generations[0]['eval_seconds']
+    print(f'{len(generations)} generations, best fitness {best["fitness"]["max"]:.1f} in generation '
+          f'{best["generation"]}')
+    print(f'{matches} matches played, {cached} from the match cache, {ticks} ticks simulated')
+    print(f'{eval_seconds:.1f} s evaluating, {wall:.1f} s in total, '
+          f'{ticks / eval_seconds if eval_seconds else 0:.0f} ticks/s while evaluating')
+
+
+def plot(runs, path=None):
+    # Fitness, species and throughput by generation, one line per file. Needs matplotlib
+    import matplotlib
+    if path is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure, (fitness_axes, species_axes, speed_axes) = plt.subplots(3, 1, sharex=True, figsize=(10, 9))
+    for name, generations in runs:
+        x = [metrics['generation'] for metrics in generations]
+        fitness_axes.plot(x, [metrics['fitness']['max'] for metrics in generations], label=f'{name} best')
+        fitness_axes.plot(x, [metrics['fitness']['mean'] for metrics in generations], '--', label=f'{name} mean')
+        species_axes.plot(x, [metrics['species'] for metrics in generations], label=name)
+        speed_axes.plot(x, [metrics.get('ticks', 0) / metrics['eval_seconds'] if metrics['eval_seconds'] else 0
+                            for metrics in generations], label=name)
+    fitness_axes.set_ylabel('fitness')
+    species_axes.set_ylabel('species')
+    speed_axes.set_ylabel('ticks / s')
+    speed_axes.set_xlabel('generation')
+    fitness_axes.legend()
+
+    if path is None:
+        plt.show()
+    else:
+        figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the metrics of a training run')
+    parser.add_argument('path', nargs='?', help=f'metrics file or run directory, the latest run in {CHECKPOINT_DIR} '
+                                                f'by default')
+    parser.add_argument('--every', type=int, default=1, help='only show every so many generations')
+    parser.add_argument('--plot', action='store_true', help='plot the run with matplotlib')
+    parser.add_argument('--output', help='save the plot to this file instead of showing it')
+    args = parser.parse_args()
+
+    path = args.path if args.path is not None else latest_run()
+    paths = metrics_files(path) if os.path.isdir(path) else [path]
+    if not paths:
+        raise FileNotFoundError(f'No {METRICS_FILE} in {path}')
+
+    runs = [(os.path.basename(os.path.dirname(file)) or file, read_metrics(file)) for file in paths]
+    for name, generations in runs:
+        if len(runs) > 1:
+            print(name)
+        summarize(generations, args.every)
+
+    if args.plot or args.output:
+        plot(runs, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import struct
+import time
+
+import neat
+import numpy as np
+
+from compiled_net import CompiledNetwork
+from files import write_file
+from match_cache import genome_fingerprint
+from pong_env import ORIGINAL_OBSERVATIONS, genome_inputs, check_inputs
+
+MODELS_DIR = 'models'
+
+# A network file is the magic, the format version and the length of the JSON header as two little endian uint32s, the
+# header, and then the arrays of the network, each starting at a multiple of 8 bytes so they can be viewed in place
+MAGIC = b'PONGNET\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+ARRAYS = ['output_columns', 'biases', 'responses', 'link_columns', 'link_weights', 'link_counts']
+ACTIVATION_FUNCTIONS = neat.activations.ActivationFunctionSet()
+AGGREGATION_FUNCTIONS = neat.aggregations.AggregationFunctionSet()
+
+
+def config_hash(config_file):
+    with open(config_file, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+
+def network_arrays(net):
+    return {
+        'output_columns': net.output_columns.astype(np.int64),
+        'biases': net.biases,
+        'responses': net.responses,
+        'link_columns': net.link_columns,
+        'link_weights': net.link_weights,
+        'link_counts': np.array(net.link_counts, dtype=np.int64),
+    }
+
+
+def save_network(path, net, metadata):
+    arrays = network_arrays(net)
+    specs = {}
+    offset = 0
+    for name in ARRAYS:
+        array = np.ascontiguousarray(arrays[name])
+        specs[name] = (array.dtype.str, array.shape, offset)
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({
+        'metadata': metadata,
+        'num_inputs': net.num_inputs,
+        'activations': net.activations,
+        'aggregations': net.aggregations,
+        'arrays': specs,
+    }).encode()
+    start = len(MAGIC) + 8 + len(header)
+    header += b' ' * (-start % ALIGNMENT)
+
+    # Written with write_file, so nobody loads a half written network
+    chunks = [MAGIC + struct.pack('<II', FORMAT_VERSION, len(header)) + header]
+    for name in ARRAYS:
+        data = np.ascontiguousarray(arrays[name]).tobytes()
+        chunks.append(data + b'\0' * (-len(data) % ALIGNMENT))
+    write_file(path, b''.join(chunks))
+
+
+def read_header(path):
+    # The header of a network file, with the metadata, without reading the arrays
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a network file')
+        version, length = struct.unpack('<II', f.read(8))
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{path} has format version {version}, only version {FORMAT_VERSION} can be loaded')
+        header = json.loads(f.read(length))
+
+    header['data_offset'] = len(MAGIC) + 8 + length
+    return header
+
+
+def load_network(path):
+    # Rebuilds the CompiledNetwork from the arrays in the file, without neat genomes
+    # The networks are small, the file is read at once and the arrays are views of what was read
+    header = read_header(path)
+    with open(path, 'rb') as f:
+        f.seek(header['data_offset'])
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        size = dtype.itemsize * int(np.prod(shape))
+        arrays[name] = data[offset:offset + size].view(dtype).reshape(shape)
+
+    # The columns of the network are used as its node ids, the inputs are 0, 1, ... and the nodes follow them
+    # Files without aggregations only have networks that sum
+    num_inputs = header['num_inputs']
+    aggregations = header.get('aggregations', ['sum'] * len(header['activations']))
+    nodes = []
+    for p, (name, aggregation) in enumerate(zip(header['activations'], aggregations)):
+        count = arrays['link_counts'][p]
+        links = list(zip(arrays['link_columns'][p, :count].tolist(), arrays['link_weights'][p, :count].tolist()))
+        nodes.append((num_inputs + p, name, ACTIVATION_FUNCTIONS.get(name), aggregation,
+                      AGGREGATION_FUNCTIONS.get(aggregation), arrays['biases'][p].item(),
+                      arrays['responses'][p].item(), links))
+
+    return CompiledNetwork(list(range(num_inputs)), nodes, arrays['output_columns'].tolist())
+
+
+class ModelRegistry:
+    # Trained networks stored as <directory>/<name>/<version>.net, versions of a name count up from 1
+    # Loaded networks are kept, so switching between them again is instant
+    def __init__(self, directory=MODELS_DIR):
+        self.directory = directory
+        self.networks = {}
+
+    def path(self, name, version):
+        return os.path.join(self.directory, name, f'{version:04d}.net')
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if self.versions(name))
+
+    def versions(self, name):
+        directory = os.path.join(self.directory, name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(file[:-4]) for file in os.listdir(directory) if file.endswith('.net') and file[:-4].isdigit())
+
+    def latest(self, name):
+        versions = self.versions(name)
+        if not versions:
+            raise KeyError(f'No model named {name!r} in {self.directory}')
+        return versions[-1]
+
+    def save(self, name, genome, config, generation=None, fitness=None, config_file='config.txt'):
+        # Adds the genome as the next version of name and returns that version
+        # The inputs it was trained with come from the genome, see pong_env.mark_inputs
+        net = CompiledNetwork.create(genome, config)
+        observations, normalize = genome_inputs(genome)
+        version = self.versions(name)[-1] + 1 if self.versions(name) else 1
+        os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        metadata = {
+            'name': name,
+            'version': version,
+            'generation': generation,
+            'fitness': fitness,
+            'config_hash': config_hash(config_file),
+            'fingerprint': genome_fingerprint(genome),
+            'observations': list(observations),
+            'normalize': normalize,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        save_network(self.path(name, version), net, metadata)
+        self.networks[(name, version)] = net
+        return version
+
+    def metadata(self, name, version=None):
+        if version is None:
+            version = self.latest(name)
+        return read_header(self.path(name, version))['metadata']
+
+    def load(self, name, version=None):
+        # The latest version by default. Raises ValueError if the network was trained with other inputs than the
+        # current pong_env.OBSERVATIONS and NORMALIZE
+        if version is None:
+            version = self.latest(name)
+        if (name, version) not in self.networks:
+            metadata = self.metadata(name, version)
+            check_inputs(metadata.get('observations', ORIGINAL_OBSERVATIONS), metadata.get('normalize', False),
+                         f'{name}:{version}')
+            self.networks[(name, version)] = load_network(self.path(name, version))
+        return self.networks[(name, version)]
+
+    def resolve(self, model):
+        # Loads a model given as 'name' or 'name:version'
+        name, _, version = model.partition(':')
+        return self.load(name, int(version) if version else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the trained models or add a pickled genome to them')
+    parser.add_argument('--directory', default=MODELS_DIR, help='where the models are kept')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show every version of every model')
+    add = commands.add_parser('add', help='add a pickled genome, like winner.p, as a new version of a model')
+    add.add_argument('name')
+    add.add_argument('genome')
+    add.add_argument('--config', default='config.txt')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.directory)
+    if args.command == 'add':
+        config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                             neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                             args.config)
+        with open(args.genome, 'rb') as f:
+            genome = pickle.load(f)
+        version = registry.save(args.name, genome, config, fitness=genome.fitness, config_file=args.config)
+        print(f'Added {args.name}:{version}')
+        return
+
+    for name in registry.names():
+        for version in registry.versions(name):
+            metadata = registry.metadata(name, version)
+            print(f'{name}:{version:<6} generation {metadata["generation"]}  fitness {metadata["fitness"]}'
+                  f'  config {metadata["config_hash"]}  created {metadata["created"]}')
+
+
+if __name__ == '__main__':
+    main()
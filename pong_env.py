@@ -0,0 +1,136 @@
+import numpy as np
+
+from batch_pong import BatchPong, BALL_RADIUS, BALL_MAX_VEL, PADDLE1_X, PADDLE2_X
+from simulation import WIDTH, HEIGHT
+
+# What a network can be told about a match, from the side of the paddle it moves. Every observation is given as
+# (function of the Paddle and Ball classes of simulation.py, function filling a column of PongEnv, scale), the scale
+# brings it to about -1 to 1 when normalized
+# The x speed is counted towards the paddle, positive while the ball flies at it
+FEATURES = {
+    'paddle_y': (lambda paddle, opponent, ball: paddle.rect.y,
+                 lambda env, side, out: np.copyto(out, env.paddle_y[side]), HEIGHT),
+    'ball_y': (lambda paddle, opponent, ball: ball.rect.centery,
+               lambda env, side, out: np.copyto(out, env.ball_centery), HEIGHT),
+    'ball_distance': (lambda paddle, opponent, ball: abs(paddle.rect.x - ball.rect.centerx),
+                      lambda env, side, out: np.abs(env.paddle_x[side] - env.ball_centerx, out=out), WIDTH),
+    'ball_x': (lambda paddle, opponent, ball: ball.rect.centerx,
+               lambda env, side, out: np.copyto(out, env.ball_centerx), WIDTH),
+    'ball_x_vel': (lambda paddle, opponent, ball: ball.x_vel if paddle.rect.x > opponent.rect.x else -ball.x_vel,
+                   lambda env, side, out: np.multiply(env.pong.ball_x_vel, 1 if side else -1, out=out), BALL_MAX_VEL),
+    'ball_y_vel': (lambda paddle, opponent, ball: ball.y_vel,
+                   lambda env, side, out: np.copyto(out, env.pong.ball_y_vel), BALL_MAX_VEL),
+    'opponent_y': (lambda paddle, opponent, ball: opponent.rect.y,
+                   lambda env, side, out: np.copyto(out, env.paddle_y[1 - side]), HEIGHT),
+}
+
+# The inputs the networks of training, testing and game.py are given, num_inputs in config.txt has to match
+# Networks only play well with the inputs they were trained with, so saved networks remember theirs, see mark_inputs
+OBSERVATIONS = ('paddle_y', 'ball_y', 'ball_distance')
+# Divide every input by its scale
+NORMALIZE = False
+# The inputs of networks saved before they could be chosen
+ORIGINAL_OBSERVATIONS = ('paddle_y', 'ball_y', 'ball_distance')
+
+
+def check_observations(observations):
+    unknown = [name for name in observations if name not in FEATURES]
+    if unknown:
+        raise ValueError(f'Unknown observations {unknown}, choose from {list(FEATURES)}')
+
+
+def mark_inputs(genome):
+    # Remembers the current inputs on a genome about to be saved, like winner.p
+    genome.observations = list(OBSERVATIONS)
+    genome.normalize = NORMALIZE
+
+
+def genome_inputs(genome):
+    # (observations, normalize) a saved genome was trained with
+    return tuple(getattr(genome, 'observations', ORIGINAL_OBSERVATIONS)), getattr(genome, 'normalize', False)
+
+
+def check_inputs(observations, normalize, name):
+    # A saved network has to be given the inputs it was trained with
+    if tuple(observations) != tuple(OBSERVATIONS) or normalize != NORMALIZE:
+        raise ValueError(f'{name} was trained with observations {list(observations)} and normalize={normalize}, '
+                         f'not with OBSERVATIONS {list(OBSERVATIONS)} and NORMALIZE={NORMALIZE}')
+
+
+def observation_function(observations=None, normalize=None):
+    # A function (paddle, opponent, ball) -> inputs of the network moving the paddle, for the classes of simulation.py
+    # Defaults to OBSERVATIONS and NORMALIZE
+    observations = OBSERVATIONS if observations is None else tuple(observations)
+    normalize = NORMALIZE if normalize is None else normalize
+    check_observations(observations)
+    if observations == ('paddle_y', 'ball_y', 'ball_distance') and not normalize:
+        # The inputs the networks have always had, without going through FEATURES every tick
+        return lambda paddle, opponent, ball: (paddle.rect.y, ball.rect.centery, abs(paddle.rect.x - ball.rect.centerx))
+
+    features = [FEATURES[name][0] for name in observations]
+    scales = [FEATURES[name][2] if normalize else 1 for name in observations]
+    return lambda paddle, opponent, ball: tuple(feature(paddle, opponent, ball) / scale
+                                                for feature, scale in zip(features, scales))
+
+
+def decide(output):
+    # The action of a network's outputs, the index of the largest one: UP, DOWN or STAY
+    return output.index(max(output))
+
+
+def decide_batch(outputs, out=None):
+    # decide for a row of outputs per slot, np.argmax also picks the first of equal outputs
+    return np.argmax(outputs, axis=1, out=out)
+
+
+class PongEnv:
+    # n training matches stepped together behind a reset(seeds) / step(actions) interface, for trainers and batch
+    # evaluators. The matches are played by a BatchPong, its arrays hold their state
+    # observations and actions have a row per side, 0 for the left paddle and 1 for the right one, and a column per
+    # slot. Observations are written into the same arrays on every call, copy them to keep them
+    def __init__(self, n, seeds=None, observations=None, normalize=None, max_hits=50, max_ticks=None):
+        self.observations = OBSERVATIONS if observations is None else tuple(observations)
+        self.normalize = NORMALIZE if normalize is None else normalize
+        check_observations(self.observations)
+        self.fill = [FEATURES[name][1] for name in self.observations]
+        self.scales = np.array([FEATURES[name][2] if self.normalize else 1 for name in self.observations],
+                               dtype=np.float64)
+
+        self.pong = BatchPong(n, seeds, max_hits, max_ticks)
+        self.n = n
+        self.paddle_x = (PADDLE1_X, PADDLE2_X)
+        self.ball_centerx = np.empty(n, dtype=np.int64)
+        self.ball_centery = np.empty(n, dtype=np.int64)
+        self.obs = np.zeros((2, n, len(self.observations)), dtype=np.float64)
+        self.actions = np.empty((2, n), dtype=np.int64)
+
+    @property
+    def paddle_y(self):
+        return self.pong.paddle1_y, self.pong.paddle2_y
+
+    def reset(self, seeds=None, indices=None):
+        # Starts new matches in the given slots, all of them by default, and returns the observations
+        self.pong.reset(seeds, indices)
+        return self.observe()
+
+    def step(self, actions):
+        # Plays a tick with the actions of both sides, returns the observations and the matches that finished on it
+        finished = self.pong.step(actions[0], actions[1])
+        return self.observe(), finished
+
+    def observe(self):
+        np.add(self.pong.ball_x, BALL_RADIUS // 2, out=self.ball_centerx)
+        np.add(self.pong.ball_y, BALL_RADIUS // 2, out=self.ball_centery)
+        for side in (0, 1):
+            obs = self.obs[side]
+            for column, fill in enumerate(self.fill):
+                fill(self, side, obs[:, column])
+            if self.normalize:
+                obs /= self.scales
+        return self.obs
+
+    def decide(self, outputs1, outputs2):
+        # The actions of the outputs of both sides' networks, in the preallocated actions
+        decide_batch(outputs1, self.actions[0])
+        decide_batch(outputs2, self.actions[1])
+        return self.actions
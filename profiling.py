@@ -0,0 +1,125 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import neat
+
+# Timings are kept in power of two buckets of nanoseconds, bucket b holds durations below 2 ** b ns
+BUCKETS = 40
+
+
+class PhaseProfiler:
+    # Collects the time spent in every phase of the training loop and a few counters
+    # The training loop only calls it when training.profiler is set, so it costs nothing while profiling is off
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.histograms = defaultdict(lambda: [0] * BUCKETS)
+        self.counters = defaultdict(int)
+        self.last = time.perf_counter()
+
+    def add(self, phase, seconds):
+        self.totals[phase] += seconds
+        self.calls[phase] += 1
+        self.histograms[phase][min(int(seconds * 1e9).bit_length(), BUCKETS - 1)] += 1
+
+    def restart(self):
+        # Starts timing the next phase from now
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        # Records the time since the previous lap as the given phase
+        now = time.perf_counter()
+        self.add(phase, now - self.last)
+        self.last = now
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+            self.last = time.perf_counter()
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def snapshot(self):
+        # Plain data, so the stats of worker processes can be sent back and merged
+        return {
+            'totals': dict(self.totals),
+            'calls': dict(self.calls),
+            'histograms': dict(self.histograms),
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, snapshot):
+        for phase, total in snapshot['totals'].items():
+            self.totals[phase] += total
+        for phase, calls in snapshot['calls'].items():
+            self.calls[phase] += calls
+        for phase, histogram in snapshot['histograms'].items():
+            merged = self.histograms[phase]
+            for bucket, n in enumerate(histogram):
+                merged[bucket] += n
+        for counter, n in snapshot['counters'].items():
+            self.counters[counter] += n
+
+    def percentile(self, phase, fraction):
+        # Upper bound of the bucket the percentile falls in, in seconds
+        histogram = self.histograms[phase]
+        target = fraction * sum(histogram)
+        seen = 0
+        for bucket, n in enumerate(histogram):
+            seen += n
+            if n and seen >= target:
+                return 2 ** bucket / 1e9
+        return 0.0
+
+
+def instrument_reproduction(population, profiler):
+    # Times the NEAT reproduction step of population.run as the 'reproduce' phase
+    reproduce = population.reproduction.reproduce
+
+    def timed_reproduce(*args, **kwargs):
+        with profiler.phase('reproduce'):
+            return reproduce(*args, **kwargs)
+
+    population.reproduction.reproduce = timed_reproduce
+
+
+class ProfileReporter(neat.reporting.BaseReporter):
+    # Prints the phase timings and counters of every generation next to the StdOutReporter output
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.generation = None
+        self.generation_start = None
+        self.history = []
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.generation_start = time.perf_counter()
+
+    def end_generation(self, config, population, species_set):
+        profiler = self.profiler
+        elapsed = time.perf_counter() - self.generation_start
+        stats = profiler.snapshot()
+        stats['generation'] = self.generation
+        stats['seconds'] = elapsed
+        self.history.append(stats)
+
+        print(f' ****** Profile of generation {self.generation} ({elapsed:.3f} sec) ******')
+        print(f'   {"phase":20} {"calls":>10} {"total ms":>10} {"share":>7} {"mean us":>9} {"p50 us":>9} {"p99 us":>9}')
+        for phase in sorted(profiler.totals, key=profiler.totals.get, reverse=True):
+            total = profiler.totals[phase]
+            calls = profiler.calls[phase]
+            print(f'   {phase:20} {calls:10d} {total * 1e3:10.1f} {total / elapsed:7.1%} {total / calls * 1e6:9.2f}'
+                  f' {profiler.percentile(phase, 0.5) * 1e6:9.2f} {profiler.percentile(phase, 0.99) * 1e6:9.2f}')
+        for counter, n in sorted(profiler.counters.items()):
+            print(f'   {counter:20} {n:10d}')
+
+        profiler.reset()
@@ -0,0 +1,59 @@
+from simulation import WIDTH, HEIGHT
+
+WHITE = (255, 255, 255)
+# Rendered texts are kept until there are this many, then the cache starts over
+TEXT_CACHE_SIZE = 256
+
+
+class Renderer:
+    # Draws frames of the court touching only what changed, for the draw_window functions of game, training and testing
+    # begin paints the background back over everything the previous frame drew, everything drawn after it is marked,
+    # and end updates only the marked parts of the display, where things were and where they are now
+    # The background with the center line is drawn once, and every text is rendered once
+    def __init__(self, win):
+        import pygame
+        self.win = win
+        self.background = pygame.Surface(win.get_size())
+        self.background.fill('black')
+        pygame.draw.line(self.background, WHITE, (WIDTH // 2, 0), (WIDTH // 2, HEIGHT), 3)
+        self.texts = {}
+        self.previous = []
+        self.current = []
+        self.full = True
+
+    def invalidate(self):
+        # Something else drew over the window, like a menu, so the next frame redraws all of it
+        self.full = True
+
+    def text(self, font, text, color=WHITE):
+        key = (font, text, color)
+        surface = self.texts.get(key)
+        if surface is None:
+            if len(self.texts) >= TEXT_CACHE_SIZE:
+                self.texts.clear()
+            surface = self.texts[key] = font.render(text, True, color)
+        return surface
+
+    def begin(self):
+        if self.full:
+            self.win.blit(self.background, (0, 0))
+        else:
+            for rect in self.previous:
+                self.win.blit(self.background, rect, rect)
+        self.current = []
+
+    def mark(self, rect):
+        self.current.append(rect)
+        return rect
+
+    def blit(self, surface, position):
+        return self.mark(self.win.blit(surface, position))
+
+    def end(self):
+        import pygame
+        if self.full:
+            pygame.display.update()
+            self.full = False
+        else:
+            pygame.display.update(self.previous + self.current)
+        self.previous = self.current
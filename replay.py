@@ -0,0 +1,300 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import struct
+import time
+import zlib
+
+from renderer import Renderer
+from simulation import (WIDTH, HEIGHT, PADDLE_OFFSET, TRAINING_RULES, Rules, Paddle, Ball, handle_collisions,
+                        move_paddle)
+
+# A replay file is the magic and the format version as a little endian uint32, followed by the recorded matches
+# A match is the length of its JSON header as a uint32, the header and a zlib stream of one byte per tick, with the move
+# of the left paddle in bits 0-1 and the move of the right paddle in bits 2-3: 0 up, 1 down, 2 stay
+# The header holds the seed of the ball, anything that differs from a fresh training match, like the rules or the
+# state the match started from, and whatever the recorder wants to remember about the match. Without a state the match
+# is played back from the start of a fresh match, created like train_ai creates it. With a state, the ball's serves are
+# drawn from a generator seeded when the match started
+# Matches recorded at once also store the compressed size, a match recorded tick by tick is the last one in its file
+# Playing a match back re-simulates it from the seed and the moves, which gives exactly the recorded match
+MAGIC = b'PONGRPL\0'
+FORMAT_VERSION = 1
+COMPRESSION_LEVEL = 1
+# A match recorded tick by tick is written out every second of play, a crash loses at most that much of it
+FLUSH_TICKS = 60
+
+UP = 0
+DOWN = 1
+STAY = 2
+
+TICK_RATE = 60
+# The state of a match played back is kept every KEYFRAME_INTERVAL ticks, seeking starts from the closest one
+KEYFRAME_INTERVAL = 600
+# How far the arrow keys seek while watching a match
+SEEK_TICKS = 5 * TICK_RATE
+
+
+def paddle_move(paddle, y):
+    # How the paddle moved since it was at y, for paddles that aren't moved by a single decision, like the keyboard
+    if paddle.rect.y < y:
+        return UP
+    if paddle.rect.y > y:
+        return DOWN
+    return STAY
+
+
+def match_state(paddle1, paddle2, ball):
+    # The state a match that isn't a fresh training match starts from, for the header
+    return {
+        'paddles': [[paddle.rect.y, paddle.vel, paddle.hits, paddle.score] for paddle in (paddle1, paddle2)],
+        'ball': [ball.rect.x, ball.rect.y, ball.x_vel, ball.y_vel],
+    }
+
+
+def rules_header(rules):
+    # The rules of a match for the header, nothing for the training rules
+    fields = {name: getattr(rules, name) for name in Rules.__slots__}
+    if fields == {name: getattr(TRAINING_RULES, name) for name in Rules.__slots__}:
+        return {}
+    return {'rules': fields}
+
+
+def session_writer(directory, prefix):
+    # A writer for a new file in directory named after prefix and the time, sessions started in the same second get a
+    # counter added to the name instead of overwriting each other
+    os.makedirs(directory, exist_ok=True)
+    name = time.strftime(f'{prefix}-%Y%m%d-%H%M%S')
+    for count in itertools.count():
+        try:
+            return ReplayWriter(os.path.join(directory, f'{name}-{count}.rpl' if count else f'{name}.rpl'), 'xb')
+        except FileExistsError:
+            pass
+
+
+class ReplayWriter:
+    # Writes matches to a replay file, either a whole match at once with add, or tick by tick between start and end
+    # With mode 'xb' it raises FileExistsError instead of overwriting a file
+    def __init__(self, path, mode='wb'):
+        self.path = path
+        self.file = open(path, mode)
+        self.file.write(MAGIC + struct.pack('<I', FORMAT_VERSION))
+        self.compressor = None
+        self.pending = bytearray()
+
+    def write_header(self, header):
+        data = json.dumps(header, separators=(',', ':')).encode()
+        self.file.write(struct.pack('<I', len(data)) + data)
+
+    def add(self, header, moves):
+        # moves holds the byte of every tick
+        data = zlib.compress(moves, COMPRESSION_LEVEL)
+        self.write_header(dict(header, size=len(data)))
+        self.file.write(data)
+
+    def start(self, header):
+        self.end()
+        self.write_header(header)
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    def tick(self, move1, move2):
+        self.pending.append(move1 | move2 << 2)
+        if len(self.pending) >= FLUSH_TICKS:
+            self.flush()
+
+    def flush(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.compress(self.pending) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+        self.pending.clear()
+
+    def end(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.compress(self.pending) + self.compressor.flush())
+            self.compressor = None
+        self.pending.clear()
+
+    def close(self):
+        self.end()
+        self.file.close()
+
+
+def read_replays(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a replay file')
+    version, = struct.unpack_from('<I', data, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise ValueError(f'{path} has format version {version}, only version {FORMAT_VERSION} can be played')
+
+    replays = []
+    offset = len(MAGIC) + 4
+    while offset + 4 <= len(data):
+        length, = struct.unpack_from('<I', data, offset)
+        header = json.loads(data[offset + 4:offset + 4 + length])
+        offset += 4 + length
+        decompressor = zlib.decompressobj()
+        if 'size' in header:
+            moves = decompressor.decompress(data[offset:offset + header['size']])
+            offset += header['size']
+        else:
+            # Recorded tick by tick, the match ends with its zlib stream, or where the recording stopped
+            moves = decompressor.decompress(data[offset:])
+            offset = len(data) - len(decompressor.unused_data)
+        replays.append(Replay(header, moves))
+
+    return replays
+
+
+class Replay:
+    # A recorded match played back: step plays the next tick, seek jumps to any tick
+    def __init__(self, header, moves):
+        self.header = header
+        self.moves = moves
+        self.rules = Rules(**header['rules']) if 'rules' in header else TRAINING_RULES
+        self.keyframes = {}
+        self.restart()
+
+    def __len__(self):
+        return len(self.moves)
+
+    def restart(self):
+        # The ball is created like train_ai creates it, so its random serves come out the same
+        self.paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
+        self.paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
+        self.ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random(self.header['seed']), self.rules)
+        self.tick = 0
+        state = self.header.get('state')
+        if state is not None:
+            self.ball.rng = random.Random(self.header['seed'])
+            for paddle, (y, vel, hits, score) in zip((self.paddle1, self.paddle2), state['paddles']):
+                paddle.rect.y, paddle.vel, paddle.hits, paddle.score = y, vel, hits, score
+            self.ball.rect.x, self.ball.rect.y, self.ball.x_vel, self.ball.y_vel = state['ball']
+
+    def step(self):
+        # Plays the next tick and returns the events of handle_collisions
+        move = self.moves[self.tick]
+        move_paddle(self.paddle1, move & 3)
+        move_paddle(self.paddle2, move >> 2 & 3)
+        self.ball.move()
+        events = handle_collisions(self.ball, self.paddle1, self.paddle2, self.rules)
+        self.tick += 1
+        if self.tick % KEYFRAME_INTERVAL == 0 and self.tick not in self.keyframes:
+            self.keyframes[self.tick] = self.snapshot()
+        return events
+
+    def snapshot(self):
+        return ([(paddle.rect.y, paddle.hits, paddle.score) for paddle in (self.paddle1, self.paddle2)],
+                (self.ball.rect.x, self.ball.rect.y, self.ball.x_vel, self.ball.y_vel), self.ball.rng.getstate())
+
+    def restore(self, tick):
+        paddles, ball, rng_state = self.keyframes[tick]
+        for paddle, (y, hits, score) in zip((self.paddle1, self.paddle2), paddles):
+            paddle.rect.y, paddle.hits, paddle.score = y, hits, score
+        self.ball.rect.x, self.ball.rect.y, self.ball.x_vel, self.ball.y_vel = ball
+        self.ball.rng.setstate(rng_state)
+        self.tick = tick
+
+    def seek(self, tick):
+        tick = max(0, min(tick, len(self)))
+        keyframe = max((k for k in self.keyframes if k <= tick), default=0)
+        if tick < self.tick or keyframe > self.tick:
+            if keyframe:
+                self.restore(keyframe)
+            else:
+                self.restart()
+        while self.tick < tick:
+            self.step()
+
+
+def describe(index, replay):
+    header = replay.header
+    parts = [f'{index:5}  {len(replay):6} ticks']
+    if 'generation' in header:
+        parts.append(f'generation {header["generation"]}')
+    if 'left' in header:
+        parts.append(f'{header["left"]} vs {header["right"]}')
+    if 'fitness' in header:
+        parts.append('fitness ' + ' / '.join(f'{fitness:.2f}' for fitness in header['fitness']))
+    parts.append(f'seed {header["seed"]}')
+    return '  '.join(parts)
+
+
+def watch(replay, speed=1.0, start=0):
+    # Plays the match back in a window. Space pauses, the left and right arrows seek, up and down change the speed and
+    # Home starts over. Speeds above 1 play several ticks per frame
+    import pygame
+    pygame.init()
+    win = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption('Pong replay')
+    font = pygame.font.SysFont('timesnewroman', 30)
+    renderer = Renderer(win)
+    clock = pygame.time.Clock()
+    paused = False
+    replay.seek(start)
+    ticks = float(replay.tick)
+
+    while True:
+        frame_time = clock.tick(TICK_RATE) / 1000
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+            if event.type == pygame.WINDOWEXPOSED:
+                renderer.invalidate()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_LEFT:
+                    replay.seek(replay.tick - SEEK_TICKS)
+                elif event.key == pygame.K_RIGHT:
+                    replay.seek(replay.tick + SEEK_TICKS)
+                elif event.key == pygame.K_HOME:
+                    replay.seek(0)
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed /= 2
+                ticks = float(replay.tick)
+
+        if not paused:
+            ticks = min(ticks + frame_time * TICK_RATE * speed, len(replay))
+            replay.seek(int(ticks))
+
+        paddle1, paddle2, ball = replay.paddle1, replay.paddle2, replay.ball
+        renderer.begin()
+        score1_text = renderer.text(font, f'{paddle1.score}')
+        score2_text = renderer.text(font, f'{paddle2.score}')
+        renderer.blit(score1_text, (WIDTH // 2 - score1_text.get_width() - 20, 10))
+        renderer.blit(score2_text, (WIDTH // 2 + 20, 10))
+        status = f'{replay.tick / TICK_RATE:.1f} / {len(replay) / TICK_RATE:.1f} s  x{speed:g}'
+        renderer.blit(renderer.text(font, status + ('  paused' if paused else '')), (10, HEIGHT - 40))
+        renderer.mark(paddle1.draw(win))
+        renderer.mark(paddle2.draw(win))
+        renderer.mark(ball.draw(win))
+        renderer.end()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the matches of a replay file or watch one of them')
+    parser.add_argument('path')
+    parser.add_argument('--list', action='store_true', help='list the matches instead of watching one')
+    parser.add_argument('--match', type=int, default=0, help='index of the match to watch, as shown by --list')
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed, 2 plays twice as fast')
+    parser.add_argument('--start', type=float, default=0.0, help='second of the match to start watching from')
+    args = parser.parse_args()
+
+    replays = read_replays(args.path)
+    if args.list:
+        for index, replay in enumerate(replays):
+            print(describe(index, replay))
+        return
+
+    watch(replays[args.match], args.speed, int(args.start * TICK_RATE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import zlib
+
+# Pairing schedules for eval_genomes
+# A pairing (i, j) means player i plays player j, with i on the left and j on the right
+
+
+def round_robin(n):
+    # Every player plays every player after it once, n * (n - 1) / 2 matches
+    return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+
+def random_opponents(n, k, rng):
+    # Every player challenges k different random opponents, so everyone plays at least k matches
+    k = min(k, n - 1)
+    pairings = []
+    for i in range(n):
+        opponents = rng.sample([j for j in range(n) if j != i], k)
+        pairings.extend((i, j) for j in opponents)
+
+    return pairings
+
+
+def swiss_round(n, scores, played, rng):
+    # One round of a Swiss tournament: players with similar scores so far play each other, avoiding rematches when
+    # possible. scores maps a player to its score so far and played is a set of the pairings already played
+    # With an odd number of players the lowest ranked one sits the round out
+    order = list(range(n))
+    rng.shuffle(order)
+    order.sort(key=lambda i: scores.get(i, 0), reverse=True)
+
+    pairings = []
+    unpaired = order
+    while len(unpaired) > 1:
+        i = unpaired[0]
+        rest = unpaired[1:]
+        j = next((j for j in rest if (i, j) not in played and (j, i) not in played), rest[0])
+        pairings.append((i, j))
+        unpaired = [p for p in rest if p != j]
+
+    return pairings
+
+
+def hall_of_fame(keys, hall_keys, sample, seed):
+    # Every player plays its own sample of the hall of fame, whose members are numbered n, n + 1, ... keys and hall_keys
+    # are the genome keys of the players and the members. A player's sample is the members with the lowest hashes of
+    # its key and theirs, so it stays the same from generation to generation, apart from members joining or leaving
+    n = len(keys)
+    pairings = []
+    for i, key in enumerate(keys):
+        members = [m for m in range(len(hall_keys)) if hall_keys[m] != key]
+        members.sort(key=lambda m: zlib.crc32(f'{seed}:{key}:{hall_keys[m]}'.encode()))
+        pairings.extend((i, n + m) for m in sorted(members[:sample]))
+
+    return pairings
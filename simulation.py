@@ -0,0 +1,225 @@
+import random
+
+WIDTH = 800
+HEIGHT = 500
+PADDLE_OFFSET = 25
+
+# Bits of the value handle_collisions returns, telling the caller what happened on this tick
+WALL = 1
+SCORE_LEFT = 2
+SCORE_RIGHT = 4
+HIT_LEFT = 8
+HIT_RIGHT = 16
+
+
+class Rules:
+    # The places where the physics of game.py and of training / testing used to differ
+    __slots__ = ('wall_lookahead', 'paddle_tolerance', 'right_hit_from_center', 'flat_serves', 'first_serve')
+
+    def __init__(self, wall_lookahead=False, paddle_tolerance=0, right_hit_from_center=False, flat_serves=False,
+                 first_serve=None):
+        # Bounce off the bottom a tick early, checking where the ball will be instead of where it is
+        self.wall_lookahead = wall_lookahead
+        # Extra pixels below a paddle that still count as a hit
+        self.paddle_tolerance = paddle_tolerance
+        # Check hits on the right paddle from the center of the ball instead of its left side
+        self.right_hit_from_center = right_hit_from_center
+        # Serves can go straight across with no vertical speed
+        self.flat_serves = flat_serves
+        # (x_vel sign, y_vel) of the very first serve, None serves to the right with a random y_vel
+        self.first_serve = first_serve
+
+
+# The rules the networks are trained and tested with
+TRAINING_RULES = Rules()
+# The rules game.py has always been played with
+GAME_RULES = Rules(wall_lookahead=True, paddle_tolerance=5, right_hit_from_center=True, flat_serves=True,
+                   first_serve=(-1, 0))
+
+
+def round_coordinate(value):
+    # pygame.Rect rounds float coordinates half away from zero
+    whole = int(value)
+    if abs(value - whole) >= 0.5:
+        whole += 1 if value > 0 else -1
+    return whole
+
+
+class Rect:
+    # The parts of pygame.Rect the simulation uses, so it runs without pygame
+    __slots__ = ('x', 'y', 'width', 'height')
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def bottom(self):
+        return self.y + self.height
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def right(self):
+        return self.x + self.width
+
+    @property
+    def centerx(self):
+        return self.x + self.width // 2
+
+    @centerx.setter
+    def centerx(self, value):
+        self.x = value - self.width // 2
+
+    @property
+    def centery(self):
+        return self.y + self.height // 2
+
+    @centery.setter
+    def centery(self, value):
+        self.y = value - self.height // 2
+
+    def tuple(self):
+        return self.x, self.y, self.width, self.height
+
+
+class Paddle:
+    __slots__ = ('length', 'width', 'original_x', 'original_y', 'rect', 'vel', 'hits', 'score')
+
+    def __init__(self, x, y):
+        self.length = 100
+        self.width = 20
+        self.original_x = x
+        self.original_y = y
+        self.rect = Rect(x - self.width // 2, y - self.length // 2, self.width, self.length)
+        self.vel = 7
+        self.hits = 0
+        self.score = 0
+
+    def draw(self, win, rect=None):
+        # rect draws the paddle somewhere else than where it is, like in between two ticks
+        import pygame
+        return pygame.draw.rect(win, (255, 255, 255), self.rect.tuple() if rect is None else rect)
+
+    def move(self, direction):
+        if direction == 'up':
+            self.rect.y -= self.vel
+
+        elif direction == 'down':
+            self.rect.y += self.vel
+
+    def reset(self):
+        self.rect.centerx = self.original_x
+        self.rect.centery = self.original_y
+
+
+def move_paddle(paddle, decision):
+    # Moves the paddle by a decision of a network or a replay, 0 up, 1 down and anything else stays, as long as it stays
+    # on the screen. Returns whether the paddle moved
+    if decision == 0:
+        if paddle.rect.top > 0:
+            paddle.move('up')
+            return True
+    elif decision == 1:
+        if paddle.rect.bottom < HEIGHT:
+            paddle.move('down')
+            return True
+    return False
+
+
+class Ball:
+    __slots__ = ('radius', 'max_vel', 'rng', 'rules', 'x_vel', 'y_vel', 'rect')
+
+    def __init__(self, x, y, rng=None, rules=TRAINING_RULES):
+        self.radius = 15
+        self.max_vel = 7
+        # Seeded matches pass their own random.Random so the serves can be reproduced
+        self.rng = random if rng is None else rng
+        self.rules = rules
+        if rules.first_serve is None:
+            self.x_vel = self.max_vel
+            self.y_vel = self.initialize_y_vel()
+        else:
+            direction, self.y_vel = rules.first_serve
+            self.x_vel = direction * self.max_vel
+        self.rect = Rect(x - self.radius // 2, y - self.radius // 2, self.radius, self.radius)
+
+    def initialize_y_vel(self):
+        y_vel = self.rng.randint(-3, 3)
+        while y_vel == 0 and not self.rules.flat_serves:
+            y_vel = self.rng.randint(-3, 3)
+
+        return y_vel
+
+    def draw(self, win, rect=None):
+        import pygame
+        return pygame.draw.ellipse(win, (255, 255, 255), self.rect.tuple() if rect is None else rect)
+
+    def move(self):
+        self.rect.x = round_coordinate(self.rect.x + self.x_vel)
+        self.rect.y = round_coordinate(self.rect.y + self.y_vel)
+
+    def reset(self):
+        self.rect.centerx = WIDTH // 2
+        self.rect.centery = HEIGHT // 2
+        self.y_vel = self.initialize_y_vel()
+
+
+def handle_collisions(ball, paddle1, paddle2, rules=TRAINING_RULES):
+    # Bounces the ball off the walls and paddles, counts scores and hits on the paddles and returns what happened
+    events = 0
+    rect = ball.rect
+
+    # Check for collisions with wall
+    bottom = rect.y + rect.height
+    if rules.wall_lookahead:
+        bottom += ball.y_vel
+    if rect.y <= 0 or bottom >= HEIGHT:
+        ball.y_vel = -ball.y_vel
+        events |= WALL
+
+    # Check for collisions on left and right sides
+    if rect.x + rect.width <= 0:
+        paddle2.score += 1
+        ball.reset()
+        ball.x_vel = ball.max_vel
+        events |= SCORE_RIGHT
+
+    elif rect.x >= WIDTH:
+        paddle1.score += 1
+        ball.reset()
+        ball.x_vel = -ball.max_vel
+        events |= SCORE_LEFT
+
+    centery = rect.y + rect.height // 2
+    if ball.x_vel < 0:
+        if paddle1.rect.y <= centery <= paddle1.rect.y + paddle1.length + rules.paddle_tolerance:
+            if paddle1.rect.x + paddle1.width >= rect.x:
+                ball.x_vel = -ball.x_vel
+
+                y_difference = paddle1.rect.y + paddle1.length // 2 - centery
+                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
+                ball.y_vel = -y_vel
+                paddle1.hits += 1
+                events |= HIT_LEFT
+    else:
+        if paddle2.rect.y <= centery <= paddle2.rect.y + paddle2.length + rules.paddle_tolerance:
+            ball_x = rect.x + rect.width // 2 if rules.right_hit_from_center else rect.x
+            if paddle2.rect.x <= ball_x + ball.radius:
+                ball.x_vel = -ball.x_vel
+
+                y_difference = paddle2.rect.y + paddle2.length // 2 - centery
+                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
+                ball.y_vel = -y_vel
+                paddle2.hits += 1
+                events |= HIT_RIGHT
+
+    return events
@@ -0,0 +1,178 @@
+import os
+import random
+import re
+
+import neat
+import numpy as np
+import pytest
+
+import training
+from batch_pong import BatchPong, BALL_RADIUS, PADDLE_LENGTH, predict_intercepts
+from compiled_net import CompiledNetwork
+from pong_env import FEATURES, PongEnv, observation_function
+from simulation import (WIDTH, HEIGHT, PADDLE_OFFSET, GAME_RULES, TRAINING_RULES, Paddle, Ball, handle_collisions,
+                        move_paddle)
+
+# Seeded checks that the fast paths give exactly what the code they replace gives: compiled networks against neat,
+# BatchPong, PongEnv and the intercept prediction against the Paddle and Ball classes, and the batched matches of
+# training against play_match
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
+
+
+def load_config(path=CONFIG_FILE):
+    return neat.Config(neat.DefaultGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                       path)
+
+
+def make_genomes(config, n, seed):
+    # Mutated a few times so the networks have hidden nodes
+    random.seed(seed)
+    config.pop_size = n
+    population = neat.Population(config)
+    for genome in population.population.values():
+        for _ in range(8):
+            genome.mutate(config.genome_config)
+    return list(population.population.items())
+
+
+def every_function_config(tmp_path):
+    # config.txt with every activation and aggregation neat has built in, mutating between them often
+    with open(CONFIG_FILE) as f:
+        text = f.read()
+    activations = ' '.join(sorted(neat.activations.ActivationFunctionSet().functions))
+    aggregations = ' '.join(sorted(neat.aggregations.AggregationFunctionSet().functions))
+    for option, value in (('activation_options', activations), ('activation_mutate_rate', '0.5'),
+                          ('aggregation_options', aggregations), ('aggregation_mutate_rate', '0.5')):
+        text = re.sub(rf'^{option}\s*=.*$', f'{option} = {value}', text, flags=re.MULTILINE)
+    path = tmp_path / 'config.txt'
+    path.write_text(text)
+    return load_config(str(path))
+
+
+def follow_ball(paddle_y, ball_y, rng):
+    # Decisions that keep some rallies going until MAX_HITS, with enough random ones that others end in a score
+    actions = np.where(paddle_y + PADDLE_LENGTH // 2 > ball_y + BALL_RADIUS // 2, 0, 1)
+    noise = rng.random(len(actions)) < 0.4
+    return np.where(noise, rng.integers(0, 3, len(actions)), actions)
+
+
+def fresh_match(seed):
+    paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
+    paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random(seed))
+    return paddle1, paddle2, ball
+
+
+@pytest.mark.parametrize('every_function', [False, True])
+def test_compiled_network_matches_neat(every_function, tmp_path):
+    config = every_function_config(tmp_path) if every_function else load_config()
+    rng = random.Random(1)
+    for _, genome in make_genomes(config, 30, seed=1):
+        reference = neat.nn.FeedForwardNetwork.create(genome, config)
+        net = CompiledNetwork.create(genome, config)
+        inputs = [(rng.uniform(0, HEIGHT), rng.uniform(0, HEIGHT), rng.uniform(0, WIDTH)) for _ in range(20)]
+        expected = [reference.activate(x) for x in inputs]
+        assert [net.activate(x) for x in inputs] == expected
+        assert np.allclose(net.activate_batch(inputs), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_batch_pong_matches_simulation():
+    n = 64
+    seeds = list(range(n))
+    pong = BatchPong(n, seeds, max_hits=training.MAX_HITS)
+    matches = [fresh_match(seed) for seed in seeds]
+    rng = np.random.default_rng(2)
+    while pong.active.any():
+        active = pong.active.copy()
+        actions1 = follow_ball(pong.paddle1_y, pong.ball_y, rng)
+        actions2 = follow_ball(pong.paddle2_y, pong.ball_y, rng)
+        finished = pong.step(actions1, actions2)
+        for k in np.flatnonzero(active):
+            paddle1, paddle2, ball = matches[k]
+            move_paddle(paddle1, actions1[k])
+            move_paddle(paddle2, actions2[k])
+            ball.move()
+            handle_collisions(ball, paddle1, paddle2)
+            assert (pong.paddle1_y[k], pong.paddle2_y[k], pong.ball_x[k], pong.ball_y[k]) == \
+                (paddle1.rect.y, paddle2.rect.y, ball.rect.x, ball.rect.y)
+            assert (pong.hits1[k], pong.hits2[k], pong.score1[k], pong.score2[k]) == \
+                (paddle1.hits, paddle2.hits, paddle1.score, paddle2.score)
+            over = paddle1.score > 0 or paddle2.score > 0 or paddle1.hits >= training.MAX_HITS
+            assert finished[k] == over
+
+
+def reached_paddle(ball, paddle1, paddle2, rules):
+    # The x checks of the hits in handle_collisions
+    if ball.x_vel > 0:
+        hit_x = ball.rect.x + ball.rect.width // 2 if rules.right_hit_from_center else ball.rect.x
+        return paddle2.rect.x <= hit_x + ball.radius
+    return paddle1.rect.x + paddle1.width >= ball.rect.x
+
+
+@pytest.mark.parametrize('rules', [TRAINING_RULES, GAME_RULES])
+def test_predict_intercepts_matches_simulation(rules):
+    # Balls anywhere, with the speeds of serves and paddle hits, flying until they reach a paddle that isn't there
+    rng = random.Random(5)
+    states = []
+    intercepts = []
+    for _ in range(2000):
+        paddle1, paddle2, ball = fresh_match(rng.getrandbits(32))
+        ball.rules = rules
+        paddle1.rect.y = paddle2.rect.y = 10 * HEIGHT
+        ball.rect.x = rng.randint(40, WIDTH - 60)
+        ball.rect.y = rng.randint(-10, HEIGHT - 10)
+        ball.x_vel = rng.choice((-ball.max_vel, ball.max_vel))
+        ball.y_vel = rng.choice([ball.max_vel * d / 50 for d in range(-60, 61)] + list(range(-3, 4)))
+        states.append((ball.rect.x, ball.rect.y, ball.x_vel, ball.y_vel))
+        while not reached_paddle(ball, paddle1, paddle2, rules):
+            ball.move()
+            handle_collisions(ball, paddle1, paddle2, rules)
+        intercepts.append(ball.rect.centery)
+
+    x, y, x_vel, y_vel = (np.array(column) for column in zip(*states))
+    assert predict_intercepts(x, y, x_vel, y_vel, rules).tolist() == intercepts
+
+
+@pytest.mark.parametrize('normalize', [False, True])
+def test_pong_env_observations_match_simulation(normalize):
+    n = 32
+    seeds = list(range(100, 100 + n))
+    observations = tuple(FEATURES)
+    env = PongEnv(n, seeds, observations=observations, normalize=normalize, max_hits=training.MAX_HITS)
+    observe = observation_function(observations, normalize)
+    default_env = PongEnv(n, seeds, max_hits=training.MAX_HITS)
+    default_observe = observation_function()
+    matches = [fresh_match(seed) for seed in seeds]
+    rng = np.random.default_rng(3)
+    obs, default_obs = env.observe(), default_env.observe()
+    while env.pong.active.any():
+        for k in np.flatnonzero(env.pong.active):
+            paddle1, paddle2, ball = matches[k]
+            assert tuple(obs[0, k]) == observe(paddle1, paddle2, ball)
+            assert tuple(obs[1, k]) == observe(paddle2, paddle1, ball)
+            assert tuple(default_obs[0, k]) == default_observe(paddle1, paddle2, ball)
+            assert tuple(default_obs[1, k]) == default_observe(paddle2, paddle1, ball)
+
+        actions = np.stack((follow_ball(env.pong.paddle1_y, env.pong.ball_y, rng),
+                            follow_ball(env.pong.paddle2_y, env.pong.ball_y, rng)))
+        for k in np.flatnonzero(env.pong.active):
+            paddle1, paddle2, ball = matches[k]
+            move_paddle(paddle1, actions[0, k])
+            move_paddle(paddle2, actions[1, k])
+            ball.move()
+            handle_collisions(ball, paddle1, paddle2)
+        obs, _ = env.step(actions)
+        default_obs, _ = default_env.step(actions)
+
+
+def test_batched_matches_match_play_match(monkeypatch):
+    config = load_config()
+    genomes = make_genomes(config, 12, seed=4)
+    pairings = [(i, j) for i in range(len(genomes)) for j in range(len(genomes)) if i != j]
+    monkeypatch.setattr(training, 'BATCH_SIZE', 16)
+
+    monkeypatch.setattr(training, 'BATCHED', True)
+    batched = training.play_pairings(genomes, pairings, config, 0)
+    monkeypatch.setattr(training, 'BATCHED', False)
+    scalar = training.play_pairings(genomes, pairings, config, 0)
+    assert sorted(batched) == sorted(scalar)
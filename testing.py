@@ -1,124 +1,65 @@
-import pygame
+import argparse
 import random
 import neat
 import pickle
-
-pygame.init()
-WIDTH = 800
-HEIGHT = 500
-PADDLE_OFFSET = 25
-window = pygame.display.set_mode((WIDTH, HEIGHT))
-score_font = pygame.font.SysFont('timesnewroman', 50)
-clock = pygame.time.Clock()
-pygame.display.set_caption('Pong')
-
-
-class Paddle:
-    def __init__(self, x, y):
-        self.length = 100
-        self.width = 20
-        self.original_x = x
-        self.original_y = y
-        self.rect = pygame.Rect(x - self.width // 2, y - self.length // 2, self.width, self.length)
-        self.vel = 7
-        self.hits = 0
-        self.score = 0
-
-    def draw(self, win):
-        pygame.draw.rect(win, (255, 255, 255), self.rect)
-
-    def move(self, direction):
-        if direction == 'up':
-            self.rect.y -= self.vel
-
-        elif direction == 'down':
-            self.rect.y += self.vel
-
-    def reset(self):
-        self.rect.centerx = self.original_x
-        self.rect.centery = self.original_y
-
-
-class Ball:
-    def __init__(self, x, y):
-        self.radius = 15
-        self.max_vel = 7
-        self.x_vel = self.max_vel
-        self.y_vel = self.initialize_y_vel()
-        self.rect = pygame.Rect(x - self.radius // 2, y - self.radius // 2, self.radius, self.radius)
-
-    def initialize_y_vel(self):
-        y_vel = random.randint(-3, 3)
-        while y_vel == 0:
-            y_vel = random.randint(-3, 3)
-
-        return y_vel
-
-    def draw(self, win):
-        pygame.draw.ellipse(win, (255, 255, 255), self.rect)
-
-    def move(self):
-        self.rect.x += self.x_vel
-        self.rect.y += self.y_vel
-
-    def reset(self):
-        self.rect.centerx = WIDTH // 2
-        self.rect.centery = HEIGHT // 2
-        self.y_vel = self.initialize_y_vel()
+import numpy as np
+from batch_pong import BALL_RADIUS, PADDLE_LENGTH, UP, DOWN, STAY, predict_intercepts
+from compiled_net import CompiledNetwork
+from model_registry import ModelRegistry
+from pong_env import PongEnv, observation_function, decide, decide_batch, genome_inputs, check_inputs
+from renderer import Renderer
+from replay import session_writer, paddle_move
+from simulation import WIDTH, HEIGHT, PADDLE_OFFSET, Paddle, Ball, handle_collisions, move_paddle
+
+TICK_RATE = 60
+# Rallies played against every scripted opponent by evaluate, and the seed their serves are drawn from
+EVAL_RALLIES = 2000
+EVAL_SEED = 0
+# A rally in which both paddles returned the ball this many times ends in a draw
+MAX_RALLY_HITS = 10
+# Paddle speeds of the game.py computer to play against, game.py itself uses AI_LEVEL = 7
+AI_LEVELS = [3, 5, 7]
+# The game.py computer waits AI_MOVE_DELAY = 500 ms after every hit before it moves again
+AI_MOVE_DELAY_TICKS = 500 * TICK_RATE // 1000
+# test_ai records the session to a replay file in REPLAY_DIR, replay.py plays it back
+RECORD_REPLAYS = True
+REPLAY_DIR = 'replays'
+
+# The window is only opened by init_display and pygame is imported where it's needed, so importing this module is cheap
+window = None
+score_font = None
+clock = None
+renderer = None
+
+
+def init_display():
+    global window, score_font, clock, renderer
+    import pygame
+    if window is None:
+        pygame.init()
+        window = pygame.display.set_mode((WIDTH, HEIGHT))
+        score_font = pygame.font.SysFont('timesnewroman', 50)
+        clock = pygame.time.Clock()
+        pygame.display.set_caption('Pong')
+        renderer = Renderer(window)
+    return window
 
 
 def draw_window(win, paddle1, paddle2, ball):
-    win.fill('black')
-    pygame.draw.line(win, (255, 255, 255), (WIDTH // 2, 0), (WIDTH // 2, HEIGHT), 3)
-
-    score1_text = score_font.render(f'{paddle1.score}', True, (255, 255, 255))
-    score2_text = score_font.render(f'{paddle2.score}', True, (255, 255, 255))
-    win.blit(score1_text, (WIDTH // 2 - score1_text.get_width() - 20, 10))
-    win.blit(score2_text, (WIDTH // 2 + 20, 10))
-    paddle1.draw(win)
-    paddle2.draw(win)
-    ball.draw(win)
-
-    pygame.display.update()
-
-
-def handle_collisions(ball, paddle1, paddle2):
-    # Check for collisions with wall
-    if ball.rect.top <= 0 or ball.rect.bottom >= HEIGHT:
-        ball.y_vel = -ball.y_vel
-
-    # Check for collisions on left and right sides
-    if ball.rect.right <= 0:
-        paddle2.score += 1
-        ball.reset()
-        ball.x_vel = ball.max_vel
-
-    elif ball.rect.left >= WIDTH:
-        paddle1.score += 1
-        ball.reset()
-        ball.x_vel = -ball.max_vel
-
-    if ball.x_vel < 0:
-        if paddle1.rect.y <= ball.rect.centery <= paddle1.rect.y + paddle1.length:
-            if paddle1.rect.x + paddle1.width >= ball.rect.x:
-                ball.x_vel = -ball.x_vel
-
-                y_difference = paddle1.rect.centery - ball.rect.centery
-                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                ball.y_vel = -y_vel
-                paddle1.hits += 1
-    else:
-        if paddle2.rect.y <= ball.rect.centery <= paddle2.rect.y + paddle2.length:
-            if paddle2.rect.x <= ball.rect.x + ball.radius:
-                ball.x_vel = -ball.x_vel
+    renderer.begin()
+    score1_text = renderer.text(score_font, f'{paddle1.score}')
+    score2_text = renderer.text(score_font, f'{paddle2.score}')
+    renderer.blit(score1_text, (WIDTH // 2 - score1_text.get_width() - 20, 10))
+    renderer.blit(score2_text, (WIDTH // 2 + 20, 10))
+    renderer.mark(paddle1.draw(win))
+    renderer.mark(paddle2.draw(win))
+    renderer.mark(ball.draw(win))
 
-                y_difference = paddle2.rect.centery - ball.rect.centery
-                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                ball.y_vel = -y_vel
-                paddle2.hits += 1
+    renderer.end()
 
 
 def player_paddle_movement(paddle):
+    import pygame
     keys = pygame.key.get_pressed()
     if keys[pygame.K_w] and paddle.rect.top > 0:
         paddle.move('up')
@@ -126,35 +67,34 @@ def player_paddle_movement(paddle):
         paddle.move('down')
 
 
-def move_ai_paddle(paddle, decision):
-    # Move up
-    if decision == 0 and paddle.rect.top > 0:
-        paddle.move('up')
-    # Move down
-    elif decision == 1 and paddle.rect.bottom < HEIGHT:
-        paddle.move('down')
-    # Do nothing
-    else:
-        pass
-
-
-def test_ai(genome, config):
-    net = neat.nn.FeedForwardNetwork.create(genome, config)
+def test_ai(net, name=None):
+    import pygame
+    init_display()
     paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
     paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
-    ball = Ball(WIDTH // 2, HEIGHT // 2)
+    seed = random.getrandbits(32)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random(seed))
+    observe = observation_function()
+
+    writer = None
+    if RECORD_REPLAYS:
+        writer = session_writer(REPLAY_DIR, 'test')
+        writer.start({'seed': seed, 'left': 'player', 'right': name})
 
     while True:
         clock.tick(60)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                if writer is not None:
+                    writer.close()
                 quit()
 
+        y1, y2 = paddle1.rect.y, paddle2.rect.y
         player_paddle_movement(paddle1)
 
-        output = net.activate((paddle2.rect.y, ball.rect.centery, abs(paddle2.rect.x - ball.rect.centerx)))
-        decision = output.index(max(output))
-        move_ai_paddle(paddle2, decision)
+        move_paddle(paddle2, decide(net.activate(observe(paddle2, paddle1, ball))))
+        if writer is not None:
+            writer.tick(paddle_move(paddle1, y1), paddle_move(paddle2, y2))
 
         ball.move()
         handle_collisions(ball, paddle1, paddle2)
@@ -162,14 +102,147 @@ def test_ai(genome, config):
         draw_window(window, paddle1, paddle2, ball)
 
 
+def steer(paddle_y, target_y):
+    # Decisions that move the paddles towards target_y like comp_paddle_movement in game.py, staying within 5 pixels
+    centery = paddle_y + PADDLE_LENGTH // 2
+    return np.where(target_y < centery - 5, UP, np.where(target_y > centery + 5, DOWN, STAY))
+
+
+class TrajectoryOpponent:
+    # The computer of game.py: moves at AI_LEVEL towards where the ball will cross a paddle, predicts again only when
+    # the ball changes direction and waits a moment after every hit
+    def __init__(self, level):
+        self.name = f'trajectory AI_LEVEL {level}'
+        self.level = level
+
+    def start(self, env):
+        env.paddle1_vel = self.level
+        self.predicted_y = np.zeros(env.n)
+        # A velocity no ball has, so the first decision predicts for every rally
+        self.x_vel = np.zeros(env.n, dtype=np.int64)
+        self.y_vel = np.zeros(env.n)
+        self.hits = np.zeros(env.n, dtype=np.int64)
+        self.last_hit = np.full(env.n, -AI_MOVE_DELAY_TICKS)
+
+    def act(self, env):
+        changed = (env.ball_x_vel != self.x_vel) | (env.ball_y_vel != self.y_vel)
+        if changed.any():
+            predicted_y = predict_intercepts(env.ball_x, env.ball_y, env.ball_x_vel, env.ball_y_vel)
+            self.predicted_y[changed] = predicted_y[changed]
+            self.x_vel = env.ball_x_vel.copy()
+            self.y_vel = env.ball_y_vel.copy()
+
+        hits = env.hits1 + env.hits2
+        self.last_hit[hits != self.hits] = env.ticks[hits != self.hits]
+        self.hits = hits
+        waiting = env.ticks - self.last_hit < AI_MOVE_DELAY_TICKS
+        return np.where(waiting, STAY, steer(env.paddle1_y, self.predicted_y))
+
+
+class RandomOpponent:
+    # Picks a random decision every tick
+    def __init__(self, seed):
+        self.name = 'random'
+        self.seed = seed
+
+    def start(self, env):
+        self.rng = np.random.default_rng(self.seed)
+
+    def act(self, env):
+        return self.rng.integers(0, 3, env.n)
+
+
+class TrackingOpponent:
+    # Follows the ball at full speed without ever waiting, it can keep up with any ball so it hardly ever misses
+    def __init__(self):
+        self.name = 'tracking'
+
+    def start(self, env):
+        pass
+
+    def act(self, env):
+        return steer(env.paddle1_y, env.ball_y + BALL_RADIUS // 2)
+
+
+def scripted_opponents(seed=EVAL_SEED):
+    return [TrajectoryOpponent(level) for level in AI_LEVELS] + [RandomOpponent(seed), TrackingOpponent()]
+
+
+def rally_stats(env):
+    hits = env.hits2.sum().item()
+    wins = env.score2.sum().item()
+    losses = env.score1.sum().item()
+    return {
+        'win_rate': wins / env.n,
+        'loss_rate': losses / env.n,
+        'draw_rate': (env.n - wins - losses) / env.n,
+        # Share of the balls that came to the genome's side that it sent back
+        'hit_rate': hits / max(hits + losses, 1),
+        'rally_hits': (env.hits1 + env.hits2).mean().item(),
+        'rally_seconds': env.ticks.mean().item() / TICK_RATE,
+    }
+
+
+def evaluate(net, opponents=None, rallies=EVAL_RALLIES, seed=EVAL_SEED):
+    # Plays seeded rallies against every opponent as fast as possible, all the rallies against an opponent at once
+    # The network is the right paddle like in test_ai and every rally starts with a serve towards it, a rally is over
+    # as soon as someone scores. Returns the stats of the network against every opponent, by name
+    if opponents is None:
+        opponents = scripted_opponents(seed)
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(rallies)]
+    # There are only six different serves, so the paddles start at random heights to make the rallies differ
+    start_rng = np.random.default_rng(seed)
+    paddle1_y = start_rng.integers(0, HEIGHT - PADDLE_LENGTH + 1, rallies)
+    paddle2_y = start_rng.integers(0, HEIGHT - PADDLE_LENGTH + 1, rallies)
+
+    report = {}
+    for opponent in opponents:
+        env = PongEnv(rallies, seeds, max_hits=MAX_RALLY_HITS)
+        pong = env.pong
+        pong.paddle1_y[:] = paddle1_y
+        pong.paddle2_y[:] = paddle2_y
+        opponent.start(pong)
+        obs = env.observe()
+        while pong.active.any():
+            obs, _ = env.step((opponent.act(pong), decide_batch(net.activate_batch(obs[1]))))
+        report[opponent.name] = rally_stats(pong)
+
+    return report
+
+
+def print_report(report):
+    print(f'{"opponent":24} {"win":>7} {"loss":>7} {"draw":>7} {"hit rate":>9} {"hits/rally":>11} {"sec/rally":>10}')
+    for name, stats in report.items():
+        print(f'{name:24} {stats["win_rate"]:7.1%} {stats["loss_rate"]:7.1%} {stats["draw_rate"]:7.1%}'
+              f' {stats["hit_rate"]:9.1%} {stats["rally_hits"]:11.2f} {stats["rally_seconds"]:10.2f}')
+
+
 if __name__ == '__main__':
-    config_file = 'config.txt'
-    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
-                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
-                         config_file)
+    parser = argparse.ArgumentParser(description='Play against the trained AI')
+    parser.add_argument('--genome', default='winner.p', help='pickled genome to test')
+    parser.add_argument('--model', help='test a model of the registry instead, given as name or name:version')
+    parser.add_argument('--evaluate', action='store_true', help='play scripted opponents instead of the keyboard')
+    parser.add_argument('--rallies', type=int, default=EVAL_RALLIES, help='rallies against every scripted opponent')
+    parser.add_argument('--seed', type=int, default=EVAL_SEED, help='seed of the serves of the rallies')
+    args = parser.parse_args()
+
+    if args.model:
+        net = ModelRegistry().resolve(args.model)
+        name = args.model
+    else:
+        config_file = 'config.txt'
+        config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                             neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                             config_file)
+        with open(args.genome, 'rb') as f:
+            winner = pickle.load(f)
+        check_inputs(*genome_inputs(winner), args.genome)
+        net = CompiledNetwork.create(winner, config)
+        name = args.genome
 
     # Test the AI
-    with open('winner.p', 'rb') as f:
-        winner = pickle.load(f)
-
-    test_ai(winner, config)
+    if args.evaluate:
+        print_report(evaluate(net, rallies=args.rallies, seed=args.seed))
+    else:
+        test_ai(net, name)
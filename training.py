@@ -1,227 +1,886 @@
-import pygame
 import random
+import queue
 import neat
-import time
 import pickle
+import os
+import multiprocessing
+import zlib
+import types
+import copy
+import traceback
+import numpy as np
+import schedules
+from simulation import WIDTH, HEIGHT, PADDLE_OFFSET, Paddle, Ball, handle_collisions, move_paddle
+from batch_pong import blocked
+from compiled_net import CompiledNetwork, NetworkBatch, batchable
+import pong_env
+from pong_env import PongEnv, observation_function, decide, mark_inputs
+from renderer import Renderer
+from profiling import PhaseProfiler, ProfileReporter, instrument_reproduction
+from match_cache import MatchCache, genome_fingerprint
+from model_registry import ModelRegistry
+from checkpoints import (AsyncCheckpointer, new_run_directory, latest_run_directory, restore_checkpoint,
+                         saved_generations)
+from islands import IslandReporter, MigrationReporter, route_migrants
+from testing import evaluate, print_report
+from replay import ReplayWriter
+from metrics import METRICS_FILE, MetricsReporter
 
-pygame.init()
-WIDTH = 800
-HEIGHT = 500
-PADDLE_OFFSET = 25
-window = pygame.display.set_mode((WIDTH, HEIGHT))
-score_font = pygame.font.SysFont('timesnewroman', 40)
-clock = pygame.time.Clock()
-pygame.display.set_caption('Pong')
 GEN = 0
 
+# Training runs headless by default. What to watch otherwise:
+# 'all' draws every match as it's played, which is slow and never runs in parallel, True means the same
+# 'best' replays the match between the two fittest genomes after every generation
+# 'every' replays every VISUALIZE_EVERY-th match of every generation
+# 'live' sends the match between the two fittest genomes of every generation to a viewer in its own process, which
+# shows them at LIVE_FPS while training carries on, matches that arrive while it's busy are skipped
+# Matches are deterministic, so a replay is exactly the match that was scored, training runs at full speed in between
+VISUALIZE = None
+VISUALIZE_EVERY = 100
+LIVE_FPS = 60
+live_view = None
+
+# Number of processes the round robin is spread over, 1 plays every match in this process
+WORKERS = os.cpu_count()
+pool = None
+
+# Matches are timed in simulation ticks, TICK_RATE ticks count as one second of play in the fitness
+TICK_RATE = 60
+# Base seed for the ball serves, every pairing derives its own seed from it
+SEED = 0
+# A match ends once the left paddle has returned the ball this many times
+MAX_HITS = 50
+# A match also ends after MAX_TICKS ticks, None for no limit
+MAX_TICKS = None
+# Simulate headless matches together in NumPy arrays, BATCH_SIZE at a time
+BATCHED = True
+BATCH_SIZE = 256
+# Once the last few matches are left they are finished one by one, a nearly empty batch is slower than that
+BATCH_TAIL = 32
+
+# How the genomes are paired up every generation: 'round_robin', 'random', 'swiss' or 'hall_of_fame'
+# Round robin plays every pairing, the other schedules play a number of matches that grows linearly with the population.
+# The fitness of a genome is its mean fitness per match played whatever the schedule, so it doesn't depend on how many
+# matches that was
+SCHEDULE = 'round_robin'
+# Opponents every genome challenges with the random schedule
+OPPONENTS = 5
+SWISS_ROUNDS = 7
+# Past champions every genome plays with the hall of fame schedule, the champion of every generation is added to it
+# and once it holds HALL_OF_FAME_SIZE of them the oldest one is dropped. Every genome plays the same HALL_OF_FAME_SAMPLE
+# of them every generation, until they leave the hall of fame, so the matches of elites come from the match cache
+HALL_OF_FAME_SAMPLE = 10
+HALL_OF_FAME_SIZE = 50
+hall_of_fame = []
+# Compiled networks of the hall of fame by genome key, None until first needed. The members never change, so every
+# process compiles them once and keeps them while they're in the hall of fame
+frozen_networks = {}
+
+# Reuse the results of matches that were already played by the same two networks with the same seed, elitism carries
+# the same genomes into later generations. Set CACHE_FILE to also keep them across runs, e.g. when restoring a checkpoint
+CACHE = True
+CACHE_SIZE = 200000
+CACHE_FILE = None
+match_cache = None
+
+# Time every phase of the training loop and print the timings after each generation
+PROFILE = False
+profiler = None
+
+# Generations to train for, a resumed run only trains the generations that are left
+GENERATIONS = 50
+
+# Checkpoints are written by a background thread every CHECKPOINT_INTERVAL generations, the newest CHECKPOINT_KEEP of
+# them are kept in a directory of CHECKPOINT_DIR for every run. Set RESUME to continue the latest run where it stopped
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_INTERVAL = 1
+CHECKPOINT_KEEP = 5
+RESUME = False
+
+# Evolve ISLANDS populations of pop_size genomes in processes of their own instead of one population, every
+# MIGRATION_INTERVAL generations every island sends its MIGRANTS fittest genomes to the next one. The WORKERS are shared
+# out between the islands, and every island keeps its checkpoints and replays in its own directory of the run
+ISLANDS = 1
+MIGRATION_INTERVAL = 5
+MIGRANTS = 2
+
+# The winner is also added to the model registry as the next version of this model
+MODEL_NAME = 'pong'
+
+# Every match played is recorded to replays-<generation>.rpl in the checkpoint directory of the run, replay.py plays
+# them back. Matches whose results come from the match cache were recorded in the generation that first played them
+RECORD_REPLAYS = True
+replay_directory = None
+# The decisions of both networks in every match of the generation, while recording
+replays = None
+
+# Every generation appends its fitness distribution, species, genome sizes, matches, ticks and evaluation time to
+# metrics.jsonl in the checkpoint directory of the run, metrics.py summarizes and plots it
+METRICS = True
+# Matches played and ticks simulated since the metrics last took them, and results served by the match cache
+match_counts = {'matches': 0, 'ticks': 0, 'cached': 0}
+
+# Play the winner against the scripted opponents of testing.py once training is done and print how it did
+EVALUATE = True
+
+# The display is only created once something actually renders, so training also works on machines without one
+# pygame itself is imported in the functions that need it, importing it is slower than everything else training needs
+window = None
+score_font = None
+renderer = None
+
+
+def init_display():
+    global window, score_font, renderer
+    import pygame
+    if window is None:
+        pygame.init()
+        window = pygame.display.set_mode((WIDTH, HEIGHT))
+        score_font = pygame.font.SysFont('timesnewroman', 40)
+        pygame.display.set_caption('Pong')
+        renderer = Renderer(window)
+    return window
 
-class Paddle:
-    def __init__(self, x, y):
-        self.length = 100
-        self.width = 20
-        self.original_x = x
-        self.original_y = y
-        self.rect = pygame.Rect(x - self.width // 2, y - self.length // 2, self.width, self.length)
-        self.vel = 7
-        self.hits = 0
-        self.score = 0
 
-    def draw(self, win):
-        pygame.draw.rect(win, (255, 255, 255), self.rect)
+def draw_window(win, paddle1, paddle2, ball, GEN):
+    renderer.begin()
+    renderer.blit(renderer.text(score_font, f'Gen: {GEN}'), (10, 10))
+    renderer.blit(renderer.text(score_font, f'Hits :{paddle1.hits + paddle2.hits}', (255, 0, 0)), (WIDTH // 4, 10))
+    score1_text = renderer.text(score_font, f'{paddle1.score}')
+    score2_text = renderer.text(score_font, f'{paddle2.score}')
+    renderer.blit(score1_text, (WIDTH // 2 - score1_text.get_width() - 20, 10))
+    renderer.blit(score2_text, (WIDTH // 2 + 20, 10))
+    renderer.mark(paddle1.draw(win))
+    renderer.mark(paddle2.draw(win))
+    renderer.mark(ball.draw(win))
+
+    renderer.end()
+
+
+def render_observer(paddle1, paddle2, ball, GEN):
+    # Opt-in observer for train_ai that draws every tick of the match
+    import pygame
+    win = init_display()
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            quit()
+    if profiler is not None:
+        profiler.lap('event_pump')
+
+    draw_window(win, paddle1, paddle2, ball, GEN)
+    if profiler is not None:
+        profiler.lap('draw_window')
 
-    def move(self, direction):
-        if direction == 'up':
-            self.rect.y -= self.vel
 
-        elif direction == 'down':
-            self.rect.y += self.vel
+def player1_paddle_movement(paddle1):
+    import pygame
+    keys = pygame.key.get_pressed()
+    if keys[pygame.K_w] and paddle1.rect.top > 0:
+        paddle1.move('up')
+    if keys[pygame.K_s] and paddle1.rect.bottom < HEIGHT:
+        paddle1.move('down')
 
-    def reset(self):
-        self.rect.centerx = self.original_x
-        self.rect.centery = self.original_y
 
+def move_ai_paddle(paddle, decision, genome):
+    if not move_paddle(paddle, decision):
+        # Reduce fitness if the AI tries to go up or down, but it can't
+        if decision == 0 or decision == 1:
+            genome.fitness -= 1
+        # Reduce fitness if the AI stands still
+        # Maybe not necessary
+        else:
+            genome.fitness -= 0.01
 
-class Ball:
-    def __init__(self, x, y):
-        self.radius = 15
-        self.max_vel = 7
-        self.x_vel = self.max_vel
-        self.y_vel = self.initialize_y_vel()
-        self.rect = pygame.Rect(x - self.radius // 2, y - self.radius // 2, self.radius, self.radius)
 
-    def initialize_y_vel(self):
-        y_vel = random.randint(-3, 3)
-        while y_vel == 0:
-            y_vel = random.randint(-3, 3)
+def show_every_match():
+    return VISUALIZE is True or VISUALIZE == 'all'
 
-        return y_vel
 
-    def draw(self, win):
-        pygame.draw.ellipse(win, (255, 255, 255), self.rect)
+def watch_match(net1, net2, seed, GEN, observer):
+    # Plays a match again only to show it, the fitness it gives is thrown away and it's left out of the profile and the
+    # ticks played
+    global profiler
+    paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
+    paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random(seed))
+    genome1 = types.SimpleNamespace(fitness=0)
+    genome2 = types.SimpleNamespace(fitness=0)
+    saved_profiler, profiler = profiler, None
+    ticks = match_counts['ticks']
+    try:
+        play_match(genome1, genome2, net1, net2, paddle1, paddle2, ball, 0, GEN, observer)
+    finally:
+        profiler = saved_profiler
+        match_counts['ticks'] = ticks
+
+
+def run_live_view(matches, fps):
+    # Runs in the viewer process of VISUALIZE = 'live' and shows the matches sent to it until it gets None
+    import pygame
+    win = init_display()
+    clock = pygame.time.Clock()
+    closed = []
+
+    def pump_events():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                closed.append(True)
+
+    def observer(paddle1, paddle2, ball, GEN):
+        pump_events()
+        if closed:
+            # Closing the window only stops the viewer, the rest of the match plays out without drawing
+            return
+        draw_window(win, paddle1, paddle2, ball, GEN)
+        clock.tick(fps)
+
+    while not closed:
+        try:
+            match = matches.get(timeout=0.1)
+        except queue.Empty:
+            pump_events()
+            continue
+        if match is None:
+            break
+        watch_match(*match, observer)
 
-    def move(self):
-        self.rect.x += self.x_vel
-        self.rect.y += self.y_vel
+    pygame.quit()
 
-    def reset(self):
-        self.rect.centerx = WIDTH // 2
-        self.rect.centery = HEIGHT // 2
-        self.y_vel = self.initialize_y_vel()
 
+def show_generation(players, n, results, config):
+    # Shows the matches VISUALIZE picks out of the ones just played by the n genomes of the generation
+    if VISUALIZE not in ('best', 'every', 'live') or n < 2:
+        return
 
-def draw_window(win, paddle1, paddle2, ball, GEN):
-    win.fill('black')
-    pygame.draw.line(win, (255, 255, 255), (WIDTH // 2, 0), (WIDTH // 2, HEIGHT), 3)
-
-    gen_text = score_font.render(f'Gen: {GEN}', True, (255, 255, 255))
-    win.blit(gen_text, (10, 10))
-    hits_text = score_font.render(f'Hits :{paddle1.hits + paddle2.hits}', True, (255, 0, 0))
-    win.blit(hits_text, (WIDTH // 4, 10))
-    score1_text = score_font.render(f'{paddle1.score}', True, (255, 255, 255))
-    score2_text = score_font.render(f'{paddle2.score}', True, (255, 255, 255))
-    win.blit(score1_text, (WIDTH // 2 - score1_text.get_width() - 20, 10))
-    win.blit(score2_text, (WIDTH // 2 + 20, 10))
-    paddle1.draw(win)
-    paddle2.draw(win)
-    ball.draw(win)
-
-    pygame.display.update()
-
-
-def handle_collisions(ball, paddle1, paddle2):
-    # Check for collisions with wall
-    if ball.rect.top <= 0 or ball.rect.bottom >= HEIGHT:
-        ball.y_vel = -ball.y_vel
-
-    # Check for collisions on left and right sides
-    if ball.rect.right <= 0:
-        paddle2.score += 1
-        ball.reset()
-        ball.x_vel = ball.max_vel
-
-    elif ball.rect.left >= WIDTH:
-        paddle1.score += 1
-        ball.reset()
-        ball.x_vel = -ball.max_vel
-
-    if ball.x_vel < 0:
-        if paddle1.rect.y <= ball.rect.centery <= paddle1.rect.y + paddle1.length:
-            if paddle1.rect.x + paddle1.width >= ball.rect.x:
-                ball.x_vel = -ball.x_vel
-
-                y_difference = paddle1.rect.centery - ball.rect.centery
-                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                ball.y_vel = -y_vel
-                paddle1.hits += 1
+    played = sorted((i, j) for i, j, *_ in results)
+    if VISUALIZE == 'every':
+        pairings = played[::VISUALIZE_EVERY]
     else:
-        if paddle2.rect.y <= ball.rect.centery <= paddle2.rect.y + paddle2.length:
-            if paddle2.rect.x <= ball.rect.x + ball.radius:
-                ball.x_vel = -ball.x_vel
-
-                y_difference = paddle2.rect.centery - ball.rect.centery
-                y_vel = (y_difference / (paddle1.length / 2)) * ball.max_vel
-                ball.y_vel = -y_vel
-                paddle2.hits += 1
-
+        best, second = sorted(range(n), key=lambda i: players[i][1].fitness, reverse=True)[:2]
+        pairings = [(second, best) if (second, best) in set(played) else (best, second)]
+
+    for i, j in pairings:
+        genome1, genome2 = players[i][1], players[j][1]
+        match = (CompiledNetwork.create(genome1, config), CompiledNetwork.create(genome2, config),
+                 match_seed(genome1, genome2), GEN)
+        if VISUALIZE == 'live':
+            send_live_view(match)
+        else:
+            watch_match(*match, render_observer)
 
-def player1_paddle_movement(paddle1):
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_w] and paddle1.rect.top > 0:
-        paddle1.move('up')
-    if keys[pygame.K_s] and paddle1.rect.bottom < HEIGHT:
-        paddle1.move('down')
 
+def send_live_view(match):
+    global live_view
+    if live_view is None:
+        matches = multiprocessing.Queue(maxsize=1)
+        process = multiprocessing.Process(target=run_live_view, args=(matches, LIVE_FPS), daemon=True)
+        process.start()
+        live_view = (process, matches)
 
-def move_ai_paddle(paddle, decision, genome):
-    # Move up
-    if decision == 0:
-        if paddle.rect.top > 0:
-            paddle.move('up')
-        # Reduce fitness if the AI tries to go up, but it can't go up
-        else:
-            genome.fitness -= 1
+    try:
+        live_view[1].put_nowait(match)
+    except queue.Full:
+        pass
 
-    # Move down
-    elif decision == 1:
-        if paddle.rect.bottom < HEIGHT:
-            paddle.move('down')
-        # Same for down
-        else:
-            genome.fitness -= 1
 
-    # Do nothing
-    else:
-        # Reduce fitness if the AI stands still
-        # Maybe not necessary
-        genome.fitness -= 0.01
+def close_live_view():
+    global live_view
+    if live_view is not None:
+        process, matches = live_view
+        # pygame turns the terminate signal into a QUIT event, the viewer gets a moment to close its window
+        process.terminate()
+        process.join(1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        live_view = None
 
 
 def calulate_fitness(paddle, duration):
     return paddle.hits + duration
 
 
-def train_ai(genome1, genome2, config, GEN):
-    start_time = time.time()
-    max_hits = 50
+def match_seed(genome1, genome2):
+    # Depends only on the two genomes, so a pairing is served the same balls whatever order it is played in
+    return zlib.crc32(f'{SEED}:{genome1.key}:{genome2.key}'.encode())
 
-    net1 = neat.nn.FeedForwardNetwork.create(genome1, config)
-    net2 = neat.nn.FeedForwardNetwork.create(genome2, config)
+
+def train_ai(genome1, genome2, config, GEN, observer=None, seed=None, moves=None):
+    net1 = compile_network(genome1, config)
+    net2 = compile_network(genome2, config)
 
     paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
     paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
-    ball = Ball(WIDTH // 2, HEIGHT // 2)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random(seed))
 
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                quit()
+    play_match(genome1, genome2, net1, net2, paddle1, paddle2, ball, 0, GEN, observer, moves)
 
-        output1 = net1.activate((paddle1.rect.y, ball.rect.centery, abs(paddle1.rect.x - ball.rect.centerx)))
-        output2 = net2.activate((paddle2.rect.y, ball.rect.centery, abs(paddle2.rect.x - ball.rect.centerx)))
 
-        decision1 = output1.index(max(output1))
-        decision2 = output2.index(max(output2))
+def play_match(genome1, genome2, net1, net2, paddle1, paddle2, ball, ticks, GEN, observer=None, moves=None):
+    # Plays a match from the given state until it's over and adds the fitness to both genomes
+    # The decisions of every tick are appended to moves when given, packed like the ticks of a replay
+    if profiler is not None:
+        profiler.count('matches')
+        profiler.restart()
+    first_tick = ticks
+    observe = observation_function()
+
+    while True:
+        decision1 = decide(net1.activate(observe(paddle1, paddle2, ball)))
+        decision2 = decide(net2.activate(observe(paddle2, paddle1, ball)))
+        if moves is not None:
+            moves.append(decision1 | decision2 << 2)
+        if profiler is not None:
+            profiler.lap('net.activate')
 
         move_ai_paddle(paddle1, decision1, genome1)
         move_ai_paddle(paddle2, decision2, genome2)
+        if profiler is not None:
+            profiler.lap('move_ai_paddle')
 
         ball.move()
         handle_collisions(ball, paddle1, paddle2)
+        if profiler is not None:
+            profiler.lap('handle_collisions')
+            profiler.count('ticks')
 
-        # Amount of time they both played
-        duration = time.time() - start_time
+        # Amount of time they both played, counted in simulation ticks so it doesn't depend on the machine
+        ticks += 1
+        duration = ticks / TICK_RATE
 
-        if paddle1.score > 0 or paddle2.score > 0 or paddle1.hits >= max_hits:
+        if (paddle1.score > 0 or paddle2.score > 0 or paddle1.hits >= MAX_HITS or
+                (MAX_TICKS is not None and ticks >= MAX_TICKS)):
+            match_counts['ticks'] += ticks - first_tick
             genome1.fitness += calulate_fitness(paddle1, duration)
             genome2.fitness += calulate_fitness(paddle2, duration)
             break
 
-        draw_window(window, paddle1, paddle2, ball, GEN)
+        if observer is not None:
+            observer(paddle1, paddle2, ball, GEN)
 
 
-def eval_genomes(genomes, config):
-    global GEN
-    GEN += 1
-    for i, (genome_id1, genome1) in enumerate(genomes):
-        if i == len(genomes) - 1:
+def paddle_penalties(paddle_y, decisions):
+    # Same fitness penalties as move_ai_paddle, for a whole batch of paddles
+    penalties = np.where((decisions == 0) | (decisions == 1), 0.0, 0.01)
+    penalties[blocked(paddle_y, decisions)] = 1
+    return penalties
+
+
+def finish_match(env, k, net1, net2, fitness1, fitness2, moves=None):
+    # Continues the match in slot k of the batch with the Paddle and Ball classes and returns the fitness of both sides
+    paddle1 = Paddle(PADDLE_OFFSET, HEIGHT // 2)
+    paddle2 = Paddle(WIDTH - PADDLE_OFFSET, HEIGHT // 2)
+    ball = Ball(WIDTH // 2, HEIGHT // 2, random.Random())
+    paddle1.rect.y = env.paddle1_y[k].item()
+    paddle2.rect.y = env.paddle2_y[k].item()
+    paddle1.hits, paddle2.hits = env.hits1[k].item(), env.hits2[k].item()
+    paddle1.score, paddle2.score = env.score1[k].item(), env.score2[k].item()
+    ball.rect.x, ball.rect.y = env.ball_x[k].item(), env.ball_y[k].item()
+    ball.x_vel, ball.y_vel = env.ball_x_vel[k].item(), env.ball_y_vel[k].item()
+    ball.rng = env.rngs[k]
+
+    # play_match only needs the fitness attribute of the genomes
+    genome1 = types.SimpleNamespace(fitness=fitness1)
+    genome2 = types.SimpleNamespace(fitness=fitness2)
+    play_match(genome1, genome2, net1, net2, paddle1, paddle2, ball, env.ticks[k].item(), GEN, moves=moves)
+    env.active[k] = False
+    return genome1.fitness, genome2.fitness
+
+
+def play_batch(genome_pairs, config, seeds, recorded=None):
+    # Plays the matches of train_ai for all the pairs, BATCH_SIZE at a time, and returns the fitness each genome gained
+    # A slot is handed the next pair as soon as its match is over, so long matches don't leave the batch half empty
+    # The decisions of every match are put in the list recorded when given, at the index of its pair
+    results = [None] * len(genome_pairs)
+    compiled = {}
+    for genome in [genome for pair in genome_pairs for genome in pair]:
+        if id(genome) not in compiled:
+            compiled[id(genome)] = compile_network(genome, config)
+
+    env = PongEnv(min(BATCH_SIZE, len(genome_pairs)), max_hits=MAX_HITS, max_ticks=MAX_TICKS)
+    pong = env.pong
+    pong.active[:] = False
+    obs = env.obs
+    pair_index = np.zeros(env.n, dtype=np.int64)
+    nets1 = NetworkBatch.for_networks(env.n, compiled.values())
+    nets2 = NetworkBatch.for_networks(env.n, compiled.values())
+    fitness1 = np.zeros(env.n)
+    fitness2 = np.zeros(env.n)
+    next_pair = 0
+    if recorded is not None:
+        # The decisions of the match in every slot, by tick, grown when a match outlasts it
+        moves = np.zeros((env.n, 1024), dtype=np.uint8)
+        slots = np.arange(env.n)
+
+    while True:
+        free = np.flatnonzero(~pong.active)[:len(genome_pairs) - next_pair]
+        if len(free):
+            new_pairs = range(next_pair, next_pair + len(free))
+            for k, p in zip(free, new_pairs):
+                genome1, genome2 = genome_pairs[p]
+                nets1.set(k, compiled[id(genome1)])
+                nets2.set(k, compiled[id(genome2)])
+            pair_index[free] = new_pairs
+            fitness1[free] = 0
+            fitness2[free] = 0
+            obs = env.reset([seeds[p] for p in new_pairs], free)
+            next_pair += len(free)
+
+        if not pong.active.any():
+            break
+
+        if next_pair == len(genome_pairs) and pong.active.sum() <= BATCH_TAIL:
+            for k in np.flatnonzero(pong.active):
+                genome1, genome2 = genome_pairs[pair_index[k]]
+                match_moves = None
+                if recorded is not None:
+                    match_moves = recorded[pair_index[k]] = bytearray(moves[k, :pong.ticks[k]])
+                results[pair_index[k]] = finish_match(pong, k, compiled[id(genome1)], compiled[id(genome2)],
+                                                      fitness1[k].item(), fitness2[k].item(), match_moves)
             break
+
+        simulated = pong.active.sum().item()
+        match_counts['ticks'] += simulated
+        if profiler is not None:
+            profiler.count('ticks', simulated)
+            profiler.restart()
+
+        decisions1, decisions2 = actions = env.decide(nets1.activate(obs[0]), nets2.activate(obs[1]))
+        if recorded is not None:
+            if pong.ticks.max() >= moves.shape[1]:
+                moves = np.concatenate((moves, np.zeros_like(moves)), axis=1)
+            active = pong.active
+            moves[slots[active], pong.ticks[active]] = decisions1[active] | decisions2[active] << 2
+        if profiler is not None:
+            profiler.lap('batch.activate')
+
+        fitness1 -= np.where(pong.active, paddle_penalties(pong.paddle1_y, decisions1), 0)
+        fitness2 -= np.where(pong.active, paddle_penalties(pong.paddle2_y, decisions2), 0)
+        if profiler is not None:
+            profiler.lap('batch.penalties')
+
+        obs, finished = env.step(actions)
+        if profiler is not None:
+            profiler.lap('batch.step')
+            profiler.count('matches', finished.sum().item())
+        duration = pong.ticks / TICK_RATE
+        fitness1[finished] += (pong.hits1 + duration)[finished]
+        fitness2[finished] += (pong.hits2 + duration)[finished]
+        for k in np.flatnonzero(finished):
+            results[pair_index[k]] = (fitness1[k].item(), fitness2[k].item())
+            if recorded is not None:
+                recorded[pair_index[k]] = moves[k, :pong.ticks[k]].tobytes()
+
+    return results
+
+
+def set_frozen(keys):
+    # Keeps the compiled networks of the hall of fame members with the given keys and forgets the others
+    for key in set(frozen_networks) - set(keys):
+        del frozen_networks[key]
+    for key in keys:
+        frozen_networks.setdefault(key, None)
+
+
+def compile_network(genome, config):
+    if genome.key not in frozen_networks:
+        return CompiledNetwork.create(genome, config)
+    net = frozen_networks[genome.key]
+    if net is None:
+        net = frozen_networks[genome.key] = CompiledNetwork.create(genome, config)
+    return net
+
+
+def play_pairings(genomes, pairings, config, GEN, observer=None, frozen=()):
+    # Plays the given pairings and returns the fitness each of the two genomes gained in every match
+    # genomes is a list of (genome_id, genome), or a dict of them by the indices used in the pairings
+    # frozen holds the keys of the hall of fame, whose networks are only compiled once
+    # While recording, the decisions of every match are added to replays
+    set_frozen(frozen)
+    results = []
+    match_counts['matches'] += len(pairings)
+    if BATCHED and observer is None:
+        # Matches of networks that can't be batched are played one at a time below
+        batched, scalar = [], []
+        for i, j in pairings:
+            (batched if batchable(genomes[i][1]) and batchable(genomes[j][1]) else scalar).append((i, j))
+        pairings = scalar
+        if batched:
+            genome_pairs = [(genomes[i][1], genomes[j][1]) for i, j in batched]
+            seeds = [match_seed(genome1, genome2) for genome1, genome2 in genome_pairs]
+            recorded = [None] * len(batched) if replays is not None else None
+            for (i, j), (fitness1, fitness2) in zip(batched, play_batch(genome_pairs, config, seeds, recorded)):
+                results.append((i, j, fitness1, fitness2))
+            if recorded is not None:
+                replays.extend((i, j, moves) for (i, j), moves in zip(batched, recorded))
+
+    for i, j in pairings:
+        genome1 = genomes[i][1]
+        genome2 = genomes[j][1]
+        fitness1, fitness2 = genome1.fitness, genome2.fitness
         genome1.fitness = 0
-        for genome_id2, genome2 in genomes[i + 1:]:
-            genome2.fitness = 0 if genome2.fitness is None else genome2.fitness
-            train_ai(genome1, genome2, config, GEN)
+        genome2.fitness = 0
+        moves = bytearray() if replays is not None else None
+        train_ai(genome1, genome2, config, GEN, observer=observer, seed=match_seed(genome1, genome2), moves=moves)
+        results.append((i, j, genome1.fitness, genome2.fitness))
+        if moves is not None:
+            replays.append((i, j, moves))
+        genome1.fitness, genome2.fitness = fitness1, fitness2
+
+    return results
+
+
+def play_shard(args):
+    # Entry point for the worker processes, also sends back what the shard played, the profile of the shard when
+    # profiling and the decisions of its matches when recording
+    global profiler, replays
+    genomes, pairings, config, GEN, frozen, profile, record = args
+    profiler = PhaseProfiler() if profile else None
+    replays = [] if record else None
+    take_match_counts()
+    results = play_pairings(genomes, pairings, config, GEN, frozen=frozen)
+    return results, take_match_counts(), profiler.snapshot() if profile else None, replays
+
+
+def take_match_counts():
+    # The counts so far, which start over from 0
+    counts = dict(match_counts)
+    for counter in match_counts:
+        match_counts[counter] = 0
+    return counts
+
+
+def mean_fitness(n, results):
+    # Mean fitness per match played for the first n players, players that didn't play get 0
+    totals = [0.0] * n
+    matches = [0] * n
+    for i, j, fitness1, fitness2 in sorted(results):
+        for player, fitness in ((i, fitness1), (j, fitness2)):
+            if player < n:
+                totals[player] += fitness
+                matches[player] += 1
+
+    return [total / count if count else 0.0 for total, count in zip(totals, matches)]
+
+
+def get_match_cache():
+    global match_cache
+    if match_cache is None:
+        # Results only carry over while the rules that decide a match's fitness stay the same
+        context = (f'max_hits={MAX_HITS} max_ticks={MAX_TICKS} tick_rate={TICK_RATE} '
+                   f'observations={",".join(pong_env.OBSERVATIONS)} normalize={pong_env.NORMALIZE}')
+        match_cache = MatchCache(CACHE_SIZE, CACHE_FILE, context=context)
+    return match_cache
+
+
+def run_pairings(players, pairings, config):
+    # Plays the pairings that aren't in the match cache and returns the results of all of them
+    if not CACHE or show_every_match():
+        return dispatch_pairings(players, pairings, config)
+
+    cache = get_match_cache()
+    fingerprints = [genome_fingerprint(genome) for _, genome in players]
+    keys = {}
+    results = []
+    missing = []
+    for i, j in pairings:
+        key = (fingerprints[i], fingerprints[j], match_seed(players[i][1], players[j][1]))
+        result = cache.get(key)
+        if result is None:
+            keys[i, j] = key
+            missing.append((i, j))
+        else:
+            results.append((i, j, *result))
+
+    match_counts['cached'] += len(results)
+    if profiler is not None:
+        profiler.count('cache_hits', len(results))
+
+    for i, j, fitness1, fitness2 in dispatch_pairings(players, missing, config):
+        cache.put(keys[i, j], (fitness1, fitness2))
+        results.append((i, j, fitness1, fitness2))
+
+    return results
+
+
+def dispatch_pairings(players, pairings, config):
+    global pool
+    if not pairings:
+        return []
+
+    frozen = [genome_id for genome_id, _ in hall_of_fame]
+    if show_every_match() or WORKERS <= 1:
+        return play_pairings(players, pairings, config, GEN, observer=render_observer if show_every_match() else None,
+                             frozen=frozen)
+
+    if pool is None:
+        pool = multiprocessing.Pool(WORKERS)
+    # Several shards per worker so a shard full of long matches doesn't hold up the whole generation
+    # A shard is only sent the players its pairings use, keyed by their index in players like in the pairings
+    shards = WORKERS * 4
+    tasks = []
+    for k in range(shards):
+        shard = pairings[k::shards]
+        if shard:
+            shard_players = {i: players[i] for pairing in shard for i in pairing}
+            tasks.append((shard_players, shard, config, GEN, frozen, profiler is not None, replays is not None))
+    results = []
+    for shard_results, shard_counts, profile, shard_replays in pool.map(play_shard, tasks):
+        results += shard_results
+        for counter, n in shard_counts.items():
+            match_counts[counter] += n
+        if profile is not None:
+            profiler.merge(profile)
+        if shard_replays is not None:
+            replays.extend(shard_replays)
+
+    return results
 
 
-def run_neat(config):
-    # p = neat.Checkpointer.restore_checkpoint('')
-    p = neat.Population(config)
-    p.add_reporter(neat.StdOutReporter(True))
-    p.add_reporter(neat.StatisticsReporter())
-    p.add_reporter(neat.Checkpointer(1))
+def eval_genomes(genomes, config):
+    global GEN, replays
+    GEN += 1
+    if RECORD_REPLAYS and replay_directory is not None:
+        replays = []
+    n = len(genomes)
+    # The schedules are drawn from their own seeded generator, so a run can be repeated
+    rng = random.Random(f'{SEED}:{GEN}')
+
+    players = genomes
+
+    if SCHEDULE == 'round_robin':
+        results = run_pairings(genomes, schedules.round_robin(n), config)
+
+    elif SCHEDULE == 'random' or (SCHEDULE == 'hall_of_fame' and not hall_of_fame):
+        results = run_pairings(genomes, schedules.random_opponents(n, OPPONENTS, rng), config)
+
+    elif SCHEDULE == 'swiss':
+        results = []
+        played = set()
+        for _ in range(SWISS_ROUNDS):
+            scores = dict(enumerate(mean_fitness(n, results)))
+            pairings = schedules.swiss_round(n, scores, played, rng)
+            results += run_pairings(genomes, pairings, config)
+            played.update(pairings)
+
+    elif SCHEDULE == 'hall_of_fame':
+        pairings = schedules.hall_of_fame([genome.key for _, genome in genomes],
+                                          [genome.key for _, genome in hall_of_fame], HALL_OF_FAME_SAMPLE, SEED)
+        players = genomes + hall_of_fame
+        results = run_pairings(players, pairings, config)
+
+    else:
+        raise ValueError(f'Unknown schedule {SCHEDULE!r}')
 
-    winner = p.run(eval_genomes, 50)
+    for (genome_id, genome), fitness in zip(genomes, mean_fitness(n, results)):
+        genome.fitness = fitness
+    show_generation(players, n, results, config)
 
+    if SCHEDULE == 'hall_of_fame':
+        genome_id, champion = max(genomes, key=lambda item: item[1].fitness)
+        # A champion that stays on top is kept once, as if it had just joined
+        hall_of_fame[:] = [member for member in hall_of_fame if member[0] != genome_id]
+        hall_of_fame.append((genome_id, copy.deepcopy(champion)))
+        del hall_of_fame[:-HALL_OF_FAME_SIZE]
+
+    save_replays(players, results)
+    save_match_cache()
+
+
+def save_replays(players, results):
+    global replays
+    if replays is None:
+        return
+
+    fitness = {(i, j): (fitness1, fitness2) for i, j, fitness1, fitness2 in results}
+    writer = ReplayWriter(os.path.join(replay_directory, f'replays-{GEN:04d}.rpl'))
+    try:
+        for i, j, moves in sorted(replays):
+            genome1, genome2 = players[i][1], players[j][1]
+            header = {'generation': GEN, 'seed': match_seed(genome1, genome2), 'left': genome1.key,
+                      'right': genome2.key, 'fitness': fitness[i, j]}
+            writer.add(header, moves)
+    finally:
+        writer.close()
+    replays = None
+
+
+def save_match_cache():
+    if CACHE and CACHE_FILE is not None:
+        get_match_cache().save()
+
+
+def close_pool():
+    global pool
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pool = None
+
+
+def restore_population(config, run_directory, generation=None):
+    global GEN
+    p, hall_of_fame[:] = restore_checkpoint(config, run_directory, generation)
+    # Generations carry on counting where the run stopped, so their replays don't overwrite the earlier ones
+    GEN = p.generation
+    return p
+
+
+def evolve(p, run_directory):
+    # Trains the population for the generations that are left, checkpointed to run_directory, and returns the winner
+    global profiler, replay_directory
+    replay_directory = run_directory
+    # Genome keys start over in every run
+    frozen_networks.clear()
+    checkpointer = AsyncCheckpointer(run_directory, CHECKPOINT_INTERVAL, CHECKPOINT_KEEP, lambda: hall_of_fame)
+    p.add_reporter(checkpointer)
+    metrics = None
+    if METRICS:
+        take_match_counts()
+        metrics = MetricsReporter(os.path.join(run_directory, METRICS_FILE), take_match_counts)
+        p.add_reporter(metrics)
+    if PROFILE:
+        profiler = PhaseProfiler()
+        p.add_reporter(ProfileReporter(profiler))
+        instrument_reproduction(p, profiler)
+
+    try:
+        return p.run(eval_genomes, GENERATIONS - p.generation)
+    finally:
+        close_pool()
+        close_live_view()
+        checkpointer.close()
+        if metrics is not None:
+            metrics.close()
+
+
+def island_directory(run_directory, index):
+    return os.path.join(run_directory, f'island-{index:02d}')
+
+
+def run_island(index, config, run_directory, generation, inbox, reports):
+    # Entry point of the island processes, evolves one population and tells the coordinator how it's doing
+    global WORKERS, VISUALIZE, CACHE_FILE
+    WORKERS = max(1, WORKERS // ISLANDS)
+    # Only the first island shows its matches
+    if index:
+        VISUALIZE = None
+    if CACHE_FILE is not None:
+        CACHE_FILE = f'{CACHE_FILE}.{index}'
+
+    try:
+        directory = island_directory(run_directory, index)
+        if generation is None:
+            # The islands start with the same random state, every one of them needs a population of its own
+            random.seed(f'{SEED}:island:{index}')
+            p = neat.Population(config)
+        else:
+            p = restore_population(config, directory, generation)
+        p.add_reporter(IslandReporter(index, reports))
+        p.add_reporter(MigrationReporter(p, index, MIGRATION_INTERVAL, MIGRANTS, inbox, reports))
+        evolve(p, directory)
+        reports.put(('done', index, p.generation, None))
+    except Exception:
+        reports.put(('done', index, None, traceback.format_exc()))
+
+
+def print_island_stats(stats, alive, best):
+    # Prints the generations every island still running has reported
+    for generation in sorted(stats):
+        if not alive <= set(stats[generation]):
+            continue
+        islands = '  '.join(f'{index}: {best_fitness:.1f} / {mean_fitness:.1f} / {species}'
+                            for index, (best_fitness, mean_fitness, species) in sorted(stats.pop(generation).items()))
+        print(f'Generation {generation}  best {best.fitness:.1f}  islands (best / mean / species) {islands}')
+
+
+def run_islands(config):
+    # Evolves the ISLANDS populations in parallel, this process only passes the migrants on, prints how the islands are
+    # doing and keeps the best genome of all of them. Returns it with the number of generations trained
+    generation = None
+    if RESUME:
+        # Every island carries on from the latest generation all of them have a checkpoint of
+        run_directory = latest_run_directory(CHECKPOINT_DIR, island_directory('', 0))
+        saved = [set(saved_generations(island_directory(run_directory, index))) for index in range(ISLANDS)]
+        generation = max(set.intersection(*saved), default=None)
+        if generation is None:
+            raise FileNotFoundError(f'No checkpoint of the same generation of all {ISLANDS} islands in {run_directory}')
+    else:
+        run_directory = new_run_directory(CHECKPOINT_DIR)
+
+    reports = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue() for _ in range(ISLANDS)]
+    # Not daemons, so every island can have its own pool of workers
+    islands = [multiprocessing.Process(target=run_island, name=f'island-{index}',
+                                       args=(index, config, run_directory, generation, inboxes[index], reports))
+               for index in range(ISLANDS)]
+    for island in islands:
+        island.start()
+
+    alive = set(range(ISLANDS))
+    migrations = {}
+    stats = {}
+    best = None
+    generations = 0
+    if RESUME:
+        # The best genomes of the islands so far, the islands only report the ones that beat them
+        for index in range(ISLANDS):
+            best_path = os.path.join(island_directory(run_directory, index), 'best.p')
+            if os.path.exists(best_path):
+                with open(best_path, 'rb') as f:
+                    genome = pickle.load(f)
+                if best is None or genome.fitness > best.fitness:
+                    best = genome
+    try:
+        while alive:
+            kind, index, island_generation, *message = reports.get()
+            if kind == 'generation':
+                best_fitness, mean_fitness, species, best_genome = message
+                stats.setdefault(island_generation, {})[index] = (best_fitness, mean_fitness, species)
+                if best_genome is not None and (best is None or best_genome.fitness > best.fitness):
+                    best = best_genome
+            elif kind == 'migrants':
+                migrations.setdefault(island_generation, {})[index] = message[0]
+            elif kind == 'done':
+                if message[0] is not None:
+                    raise RuntimeError(f'Island {index} failed:\n{message[0]}')
+                alive.discard(index)
+                generations = max(generations, island_generation)
+            route_migrants(migrations, alive, inboxes)
+            print_island_stats(stats, alive, best)
+    except BaseException:
+        for island in islands:
+            island.terminate()
+        raise
+    finally:
+        for island in islands:
+            island.join()
+
+    return best, generations
+
+
+def run_neat(config):
+    if ISLANDS > 1:
+        winner, generation = run_islands(config)
+    else:
+        if RESUME:
+            run_directory = latest_run_directory(CHECKPOINT_DIR)
+            p = restore_population(config, run_directory)
+        else:
+            run_directory = new_run_directory(CHECKPOINT_DIR)
+            p = neat.Population(config)
+        p.add_reporter(neat.StdOutReporter(True))
+        p.add_reporter(neat.StatisticsReporter())
+        winner = evolve(p, run_directory)
+        generation = p.generation
+
+    mark_inputs(winner)
     with open('winner.p', 'wb') as f:
         pickle.dump(winner, f)
+    ModelRegistry().save(MODEL_NAME, winner, config, generation=generation, fitness=winner.fitness)
+
+    if EVALUATE:
+        print_report(evaluate(CompiledNetwork.create(winner, config)))
 
 
 if __name__ == '__main__':